@@ -1,92 +1,211 @@
+import os
+
 import pygame
 from pygame.locals import *
 
-from bubbleLoader import BubbleLoader
+from bubbleLoader import BubbleLoader, PRELOADER
 from character import Player, Character, Collider
-
-UPDATE_SPRITES_EVENT = pygame.USEREVENT
+from layer import Layer
+from block import BlockTypes
+from camera import Camera
+from timestep import FixedTimestep
+from renderer import DirtyRenderer
+from entities import EntityBatch
+from profiler import PROFILER
+from controls import Controls, apply
+from assets import ASSETS
+
+TRACE_FILE = "trace.json"
+
+SIMULATION_STEP = 60
+FRAME_RATE = 20
+WINDOW_SIZE = (600, 600)
+PLAYER_START = (0, 60)
+LOADING_COLOR = (200,200,200)
 
 class App:
 
     """Handles the application"""
 
-    def __init__(self):
-        pygame.init()
-        pygame.font.init()
-        #self.window = pygame.display.set_mode((0, 0), FULLSCREEN)
-        self.window = pygame.display.set_mode((600,600))
-        pygame.display.set_caption("Bubble Platform !")
-        pygame.mouse.set_visible(False)
-        pygame.key.set_repeat(5, 5)
-
-        self.loader = BubbleLoader("test.zip", self)
+    def __init__(self, level="test.zip", simulation_step=SIMULATION_STEP, frame_rate=FRAME_RATE,
+                 interpolate=True, headless=False, record=None, exporter=None):
+        """args :
+            - level : path of the level archive
+            - simulation_step : duration of a physics step, in milliseconds
+            - frame_rate : maximum number of rendered frames per second
+            - interpolate : whether characters are drawn between their last
+              two simulated positions
+            - headless : no window is opened, only the simulation can run
+            - record : path of a file where the input script of the session
+              is written on exit (see headless.py)
+            - exporter : capture.FrameExporter the rendered frames are given to
+        """
+        # Only the subsystems used are initialized, the font module on first
+        # use (see AssetCache.font) and nothing when headless.
+        if headless:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+            self.window = None
+        else:
+            pygame.display.init()
+            #self.window = pygame.display.set_mode((0, 0), FULLSCREEN)
+            self.window = pygame.display.set_mode(WINDOW_SIZE)
+            pygame.display.set_caption("Bubble Platform !")
+            pygame.mouse.set_visible(False)
+
+        self.loader = None
+        self.loading = None
 
         self.running = False
-
-        self.player = Player((0,60))
+        self.clock = pygame.time.Clock()
+        self.timestep = FixedTimestep(simulation_step)
+        self.frame_rate = frame_rate
+        self.interpolate = interpolate
+        self.show_profiler = False
+        self.controls = Controls()
+        self.record = record
+        self.exporter = exporter
+
+        self.player = Player(PLAYER_START)
         self.objects = {self.player}
-        self.foreground = {}
-        self.background = {}
-        self.middleground = {}
+        self.block_types = BlockTypes()
+        self.foreground = Layer(self.block_types)
+        self.background = Layer(self.block_types)
+        self.middleground = Layer(self.block_types)
+        self.entities = EntityBatch()
 
+        self.camera = Camera((0, 0), WINDOW_SIZE)
         self.collider = Collider(self)
-
-        pygame.time.set_timer(UPDATE_SPRITES_EVENT, 60)
-
-        self.loader.load()
-
+        self.renderer = DirtyRenderer(self) if self.window else None
+
+        self.load_level(level)
+        self.wait_level()
+        if record:
+            self.controls.start_recording()
+
+
+    def load_level(self, level):
+        """Start reading the level archive at path level in the background,
+        the current level keeps running until install_level()."""
+        loader = BubbleLoader(level, self)
+        self.loading = (loader, loader.read())
+
+    def level_ready(self):
+        return self.loading is not None and self.loading[1].done()
+
+    def wait_level(self):
+        """Show a loading screen until the level being read is ready, then
+        install it."""
+        if self.window:
+            txt = ASSETS.text("Chargement...", 32, (0,0,0))
+            while not self.level_ready():
+                pygame.event.pump()
+                self.window.fill(LOADING_COLOR)
+                self.window.blit(txt, txt.get_rect(center=self.window.get_rect().center))
+                pygame.display.flip()
+                self.clock.tick(self.frame_rate)
+        self.install_level()
+
+    def install_level(self):
+        """Replace the current level by the one read since load_level()."""
+        loader, future = self.loading
+        data = future.result()
+        self.loading = None
+        if self.loader:
+            # A save of the current level is finished before its blocks go.
+            self.loader.wait_save()
+        for l in (self.background, self.middleground, self.foreground):
+            l.clear()
+        self.entities.clear()
+        self.player = Player(PLAYER_START)
+        self.objects = {self.player}
+        self.loader = loader
+        loader.load(data)
+        if self.renderer:
+            self.renderer.invalidate()
 
     def on_event(self, e):
-        k = pygame.key.get_pressed()
-        if k[K_LEFT]:
-            self.player.change_direction(Player.LEFT)
-            self.player.change_movement(Player.RUNNING)
-        if k[K_RIGHT]:
-            self.player.change_direction(Player.RIGHT)
-            self.player.change_movement(Player.RUNNING)
-
         if e.type == QUIT:
             self.running = False
         elif e.type == KEYDOWN:
+            self.controls.key_down(e.key)
             if e.key == K_ESCAPE:
                 self.running = False
-            elif e.key == K_UP:
-                self.player.jump()
-            if e.key == K_d:
-                self.player.change_movement(Player.DEAD)
-        elif e.type == UPDATE_SPRITES_EVENT:
+            elif e.key == K_n:
+                if self.loader.next_level and self.loading is None:
+                    self.load_level(self.loader.next_level)
+            elif e.key == K_F3:
+                self.show_profiler = not self.show_profiler
+                self.renderer.invalidate()
+            elif e.key == K_F4:
+                if PROFILER.trace is None:
+                    PROFILER.start_trace()
+                else:
+                    PROFILER.stop_trace(TRACE_FILE)
+                    print("App : Trace écrite dans " + TRACE_FILE + ".")
+
+    def on_update(self):
+        with PROFILER.phase("collide"):
+            self.collider.collide()
+        with PROFILER.phase("update"):
             for o in self.objects:
                 o.on_update()
+            self.entities.update(self.collider.tiles)
+
+    def stream_layers(self):
+        for l in (self.background, self.middleground, self.foreground):
+            l.stream(self.camera.rect)
+
+    def render_alpha(self):
+        return self.timestep.alpha if self.interpolate else 1
 
     def on_render(self):
-        for o in self.background.values():
-            o.on_render(self.window)
-        for o in self.middleground.values():
-            o.on_render(self.window)
+        """Draw the whole frame, see DirtyRenderer for the main loop."""
+        alpha = self.render_alpha()
+        self.background.on_render(self.window, self.camera)
+        self.middleground.on_render(self.window, self.camera)
         for o in self.objects:
-            o.on_render(self.window)
-        for o in self.foreground.values():
-            o.on_render(self.window)
+            o.on_render(self.window, self.camera, alpha)
+        self.entities.on_render(self.window, self.camera)
+        self.foreground.on_render(self.window, self.camera)
+        self.on_render_overlay()
+
+    def has_overlay(self):
+        """Whether on_render_overlay() draws anything."""
+        return self.show_profiler
+
+    def on_render_overlay(self):
+        """Draw what stands above the world, in window coordinates."""
+        if self.show_profiler:
+            PROFILER.on_render(self.window)
 
     def on_mainloop(self):
         self.running = True
 
         while self.running:
-            #if pygame.event.peek(KEYDOWN):
-            #    for event in pygame.event.get():
-            #        self.on_event(event)
-            #else:
-            #    self.player.change_movement(Player.MOTIONLESS)
-            self.window.fill((200,200,200))
-            self.collider.collide()
-            if not pygame.event.peek(KEYDOWN):
-                self.player.change_movement(Player.MOTIONLESS)
-
-            for e in pygame.event.get():
-                self.on_event(e)
-            self.on_render()
-            pygame.display.flip()
-            pygame.time.Clock().tick(20)
+            elapsed = self.clock.tick(self.frame_rate)
+            with PROFILER.phase("events"):
+                for e in pygame.event.get():
+                    self.on_event(e)
+                keys = pygame.key.get_pressed()
+            for _ in range(self.timestep.advance(elapsed)):
+                apply(self.player, *self.controls.snapshot(keys))
+                self.on_update()
+            if self.level_ready():
+                self.install_level()
+
+            with PROFILER.phase("render"):
+                self.camera.follow(self.player.rect)
+                self.stream_layers()
+                if self.show_profiler:
+                    self.renderer.invalidate()
+                self.renderer.render(self.render_alpha())
 
     def on_exit(self):
-        pygame.quit()
+        try:
+            if self.exporter:
+                self.exporter.close()
+        finally:
+            if self.record:
+                self.controls.stop_recording(self.record)
+            PRELOADER.shutdown()
+            pygame.quit()
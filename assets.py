@@ -0,0 +1,164 @@
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import pygame
+from pygame.locals import *
+
+CACHE_DIR = os.environ.get("BUBBLE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "bubbleplatform"))
+
+def convert(image):
+    """image in the display format, if there is a display."""
+    if pygame.display.get_surface() is None:
+        return image
+    return image.convert_alpha()
+
+class DiskCache:
+
+    """Decoded images kept on disk as raw RGBA pixels, to skip decoding
+    them (PNG...) on the next runs.
+
+    An image is stored under a hash of a key describing its content, like
+    the name, size and CRC of an archive member, and memory-mapped when
+    read back. directory None disables the cache.
+    """
+
+    MAGIC = b"BBS1"
+    HEADER = struct.Struct("<4sII")
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory or None
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".raw")
+
+    def load(self, key, decode):
+        """The image stored under key, or decode() which is then stored."""
+        if self.directory is None:
+            return decode()
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            magic, w, h = self.HEADER.unpack_from(pixels)
+            if magic == self.MAGIC and len(pixels) == self.HEADER.size + 4 * w * h:
+                # The surface keeps the mapping alive.
+                return pygame.image.frombuffer(memoryview(pixels)[self.HEADER.size:], (w, h), "RGBA")
+        except (OSError, ValueError, struct.error):
+            pass
+        image = decode()
+        self.store(path, image)
+        return image
+
+    def store(self, path, image):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, *image.get_size()))
+                f.write(pygame.image.tobytes(image, "RGBA"))
+            os.replace(tmp, path)
+        except OSError as e:
+            print("DiskCache : Impossible d'écrire " + path + " : " + str(e))
+
+DISK_CACHE = DiskCache()
+
+class AssetCache:
+
+    """Decoded sprite sheets, fonts and texts shared by the whole process.
+
+    Sheets are keyed by their path (or any key given by the caller for
+    images not read from a file), decoded and converted once, the sheets read
+    from a file going through the DISK_CACHE. The images handed out are
+    subsurfaces of the sheets, which share their pixels, and their masks are
+    computed once. The least recently used sheets are dropped when there are
+    more than max_sheets of them.
+    """
+
+    def __init__(self, max_sheets=32):
+        self.max_sheets = max_sheets
+        self.sheets = OrderedDict()
+        self.images = {}
+        self.shared = set()
+        self.masks = {}
+        self.fonts = {}
+        self.texts = {}
+
+    def sheet(self, key, image_file=None, namehint=""):
+        """The sheet stored under key, loaded from image_file (or from the
+        path key) if it is not in the cache. image_file can also be an
+        already decoded surface, which is then only converted."""
+        sheet = self.sheets.get(key)
+        if sheet is not None:
+            self.sheets.move_to_end(key)
+            return sheet
+        if isinstance(image_file, pygame.Surface):
+            sheet = convert(image_file)
+        elif image_file is None or isinstance(image_file, str):
+            path = image_file if image_file is not None else key
+            stat = os.stat(path)
+            sheet = convert(DISK_CACHE.load((os.path.abspath(path), stat.st_size, stat.st_mtime_ns),
+                                            lambda: pygame.image.load(path)))
+        else:
+            sheet = convert(pygame.image.load(image_file, namehint))
+        self.sheets[key] = sheet
+        if len(self.sheets) > self.max_sheets:
+            self.evict(next(iter(self.sheets)))
+        return sheet
+
+    def evict(self, key):
+        del self.sheets[key]
+        for k in [k for k in self.images if k[0] == key]:
+            image = self.images.pop(k)
+            self.shared.discard(image)
+            self.masks.pop(image, None)
+
+    def image(self, key, rect, sheet=None):
+        """Shared subsurface of the sheet stored under key (or of the given
+        sheet, if it was evicted in between)."""
+        rect = tuple(rect)
+        image = self.images.get((key, rect))
+        if image is None:
+            sheet = self.sheets.get(key, sheet) if sheet is not None else self.sheet(key)
+            image = self.images[(key, rect)] = sheet.subsurface(rect)
+            self.shared.add(image)
+        return image
+
+    def mask(self, image):
+        """Mask of an image, computed once for the images of the cache."""
+        mask = self.masks.get(image)
+        if mask is None:
+            mask = pygame.mask.from_surface(image)
+            if image in self.shared:
+                self.masks[image] = mask
+        return mask
+
+    def font(self, size):
+        """The default font at size, the font module being initialized on
+        first use."""
+        font = self.fonts.get(size)
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self.fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    def text(self, txt, size, color, background=None):
+        """Shared rendering of txt, it must not be drawn on."""
+        key = (txt, size, color, background)
+        image = self.texts.get(key)
+        if image is None:
+            image = self.texts[key] = self.font(size).render(txt, True, color, background)
+        return image
+
+    def clear(self):
+        self.texts.clear()
+        self.sheets.clear()
+        self.images.clear()
+        self.shared.clear()
+        self.masks.clear()
+
+ASSETS = AssetCache()
@@ -0,0 +1,159 @@
+#! /usr/bin/python3
+
+"""Benchmarks of the loader, renderer, collider and editor save on synthetic levels.
+
+    python3 benchmark.py -W 500 -H 40 -d 0.3 -o results.json
+    python3 benchmark.py -W 500 -H 40 -d 0.3 -b results.json
+
+Results are written as JSON, and compared to a previous result file with -b.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import tempfile
+import argparse
+import statistics
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from app import App
+from character import Player
+import levelformat
+
+WORLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "world")
+LAYER_MIX = {"Background blocks": 0.3, "Middleground blocks": 0.5, "Foreground blocks": 0.2}
+
+def generate_level(path, width, height, density, layer_mix=LAYER_MIX, binary=False, seed=0):
+    """Write a level of width x height blocks, with density * width * height
+    blocks spread over the layers according to layer_mix."""
+    rnd = random.Random(seed)
+    with open(os.path.join(WORLD, "manifest.json")) as f:
+        sheet = json.load(f)['Blocks']['Sprite sheet']
+    names = [d['Name'] for d in sheet['Sprites description']]
+    size = 32
+
+    blocks = {"Sprite sheet": sheet}
+    total = sum(layer_mix.values())
+    for layer, part in layer_mix.items():
+        n = int(width * height * density * part / total)
+        cells = rnd.sample(range(width * height), n)
+        blocks[layer] = [{"x": (i % width) * size, "y": (i // width) * size, "Type": rnd.choice(names)} for i in cells]
+    manifest = {"Name": "Benchmark", "Author": "benchmark", "Blocks": blocks}
+
+    members = {}
+    if binary:
+        members[levelformat.LAYERS_PATH] = levelformat.to_binary(blocks)
+        for layer in levelformat.LAYER_NAMES:
+            blocks.pop(layer, None)
+        blocks['Layers file'] = levelformat.LAYERS_PATH
+    members["manifest.json"] = json.dumps(manifest).encode()
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+        archive.write(os.path.join(WORLD, sheet['Path']), sheet['Path'])
+
+def timed(f, runs):
+    """Durations of runs calls to f, in seconds."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def summary(durations):
+    return {
+        "runs": len(durations),
+        "mean": statistics.mean(durations),
+        "median": statistics.median(durations),
+        "min": min(durations),
+        "max": max(durations),
+    }
+
+def run(args, directory):
+    level = os.path.join(directory, "level.zip")
+    generate_level(level, args.width, args.height, args.density, binary=args.binary, seed=args.seed)
+    app = App(level)
+    layers = (app.background, app.middleground, app.foreground)
+    results = {}
+
+    def load():
+        for l in layers:
+            l.clear()
+        app.loader.load()
+    results["load"] = summary(timed(load, args.runs))
+
+    copy = os.path.join(directory, "save.zip")
+    shutil.copy(level, copy)
+    app.loader.file = copy
+    def save():
+        for l in layers:
+            l.modified = True
+        app.loader.save()
+    results["save"] = summary(timed(save, args.runs))
+
+    # Pan over the level so that chunks are baked and streamed as in a game.
+    world_width = args.width * 32
+    step = max(1, (world_width - app.camera.rect.w) // max(1, args.frames - 1))
+    frame = [0]
+    def render():
+        app.camera.rect.x = min(frame[0] * step, max(0, world_width - app.camera.rect.w))
+        frame[0] += 1
+        app.stream_layers()
+        app.window.fill((200,200,200))
+        app.on_render()
+    results["render"] = summary(timed(render, args.frames))
+
+    rnd = random.Random(args.seed)
+    for _ in range(args.characters):
+        app.objects.add(Player((rnd.randrange(0, world_width), rnd.randrange(0, args.height * 32))))
+    results["collide"] = summary(timed(app.collider.collide, args.ticks))
+
+    app.on_exit()
+    return results
+
+def compare(results, baseline):
+    for name, r in results.items():
+        b = baseline.get("results", {}).get(name)
+        if not b:
+            continue
+        print("{:8} {:10.3f} ms -> {:10.3f} ms  x{:.2f}".format(
+            name, b["median"] * 1000, r["median"] * 1000, b["median"] / r["median"]), file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the loader, renderer, collider and save on a synthetic level.")
+    parser.add_argument("-W", "--width", type=int, default=200, help="level width, in blocks")
+    parser.add_argument("-H", "--height", type=int, default=40, help="level height, in blocks")
+    parser.add_argument("-d", "--density", type=float, default=0.3, help="blocks per cell, over all layers")
+    parser.add_argument("--binary", action="store_true", help="store the layers in the binary format")
+    parser.add_argument("-c", "--characters", type=int, default=100, help="characters to collide")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="runs of load and save")
+    parser.add_argument("-f", "--frames", type=int, default=200, help="frames to render")
+    parser.add_argument("-t", "--ticks", type=int, default=200, help="collision ticks")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    parser.add_argument("-b", "--baseline", help="results file to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args, directory)
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+    report = {"config": config, "results": results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -1,29 +1,78 @@
 import pygame
 from pygame.locals import *
 
+from assets import ASSETS
+
 test_in_rect = lambda rect, pos: pos[0] >= rect[0] and pos[0] < (rect[2]+rect[0]) and pos[1] >= rect[1] and pos[1] < (rect[3]+rect[1])
 get_equivalent_block_pos = lambda pos : (pos[0] - (pos[0]%Block.BLOCK_SIZE), pos[1] - (pos[1]%Block.BLOCK_SIZE))
 
+def blocks_between(start, end):
+    """(x, y, width, height), in blocks, of the rect of blocks between the
+    positions start and end, in pixels, both included."""
+    s = Block.BLOCK_SIZE
+    x0, x1 = sorted((start[0] // s, end[0] // s))
+    y0, y1 = sorted((start[1] // s, end[1] // s))
+    return x0, y0, x1 - x0 + 1, y1 - y0 + 1
+
+EMPTY = 0
+PARTIAL = 1
+FULL = 2
+
+def solidity_of(mask):
+    """EMPTY, PARTIAL or FULL, depending on how many pixels of mask are set."""
+    count = mask.count()
+    if count == 0:
+        return EMPTY
+    w, h = mask.get_size()
+    return FULL if count == w * h else PARTIAL
+
+class BlockTypes:
+
+    """The block types of a level, by name : their sprite, collision mask
+    and solidity, and the description of the sprite sheet they come from.
+
+    Each app (or simulation) has its own, shared by its layers. A simulation
+    may only know the solidity of the types.
+    """
+
+    def __init__(self):
+        self.sprites = {}
+        self.masks = {}
+        self.solidity = {}
+        self.description = {}
+
+    def add(self, name, image):
+        """Register a block type, precomputing its collision mask."""
+        self.sprites[name] = image
+        self.masks[name] = ASSETS.mask(image)
+        self.solidity[name] = solidity_of(self.masks[name])
+
+    def clear(self):
+        self.sprites.clear()
+        self.masks.clear()
+        self.solidity.clear()
+        self.description = {}
+
 class Block(pygame.sprite.Sprite):
 
-    """A block in the game."""
+    """A block in the game, of one of the types of a BlockTypes."""
 
     BLOCK_SIZE = 32
-    SPRITES = {}
-    SPRITES_DESC = {}
 
-    def __init__(self, pos, image=None):
+    def __init__(self, pos, image, types):
         super().__init__()
-        self.image = Block.SPRITES.get(image, None)
+        self.image = types.sprites.get(image, None)
         self.image_name = image
+        self.mask = types.masks.get(image, None)
+        self.solidity = types.solidity.get(image, PARTIAL)
         self.rect = self.image.get_rect()
         self.rect.x = pos[0]
         self.rect.y = pos[1]
 
-    def on_render(self, dst):
-        dst.blit(self.image, (self.rect.x, self.rect.y))
+    def on_render(self, dst, camera):
+        dst.blit(self.image, camera.apply((self.rect.x, self.rect.y)))
 
     def on_update(self):
         pass
     def as_dict(self):
-        return {"x":self.x, "y":self.y, "Type":self.image_name}
+        return {"x":self.rect.x, "y":self.rect.y, "Type":self.image_name}
@@ -1,111 +1,358 @@
+import io
+import os
 import json
+import zlib
+import shutil
 import zipfile
 import tempfile
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import pygame
 from pygame.locals import *
 
-from sprites import SpriteSheet, Animation, TimedAnimation
+from sprites import SpriteSheet
 from block import Block
+import levelformat
+from entities import CharacterType, description_errors
+from profiler import PROFILER
+from assets import ASSETS, DISK_CACHE
 
 class BubbleLoaderError(Exception):
     pass
 
+def write_member(archive, info, data, compresslevel):
+    """Write data under info, deflated at compresslevel unless it does
+    not make it smaller."""
+    if len(zlib.compress(data, compresslevel)) < len(data):
+        archive.writestr(info, data, zipfile.ZIP_DEFLATED, compresslevel)
+    else:
+        archive.writestr(info, data, zipfile.ZIP_STORED)
+
+def rewrite_archive(filepath, members, removed=(), compresslevel=None):
+    """Replace (or add) the given members of an archive, members being a
+    dict of name to bytes, and drop the removed ones. With compresslevel,
+    every member is compressed again at that level.
+
+    The new archive is written next to the old one, the other members being
+    streamed from it, and then renamed over it : a crash leaves either the
+    old or the new archive, never a truncated one."""
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(filepath)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with zipfile.ZipFile(filepath) as archive, zipfile.ZipFile(f, 'w') as new_archive:
+                for info in archive.infolist():
+                    if info.filename in removed:
+                        continue
+                    if compresslevel is not None:
+                        data = members[info.filename] if info.filename in members else archive.read(info)
+                        write_member(new_archive, info, data, compresslevel)
+                    elif info.filename in members:
+                        new_archive.writestr(info, members[info.filename])
+                    else:
+                        with archive.open(info) as src, new_archive.open(info, 'w') as dst:
+                            shutil.copyfileobj(src, dst)
+                for name in members.keys() - set(archive.namelist()):
+                    if compresslevel is not None:
+                        write_member(new_archive, zipfile.ZipInfo(name), members[name], compresslevel)
+                    else:
+                        new_archive.writestr(name, members[name], zipfile.ZIP_DEFLATED)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner only.
+        os.chmod(tmp, os.stat(filepath).st_mode & 0o7777)
+        os.replace(tmp, filepath)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+class LevelData:
+
+    """The content of a level archive, read and decoded but not installed.
+
+    Reading does not touch the display nor the app, so that it can run in
+    another thread : the sprite sheets are decoded but not converted, which
+    is done by the main thread when the level is installed.
+    """
+
+    def __init__(self, filepath):
+        self.file = filepath
+        self.manifest = {}
+        self.sheets = {}
+        self.characters = {}
+        # Messages of the characters which can not be loaded, by name.
+        self.character_errors = {}
+        self.grids = None
+        self.palette = None
+
+    def key(self, path):
+        """Key of the sprite sheet at path in the asset cache."""
+        return (os.path.abspath(self.file), path)
+
+    def read_sheet(self, archive, path):
+        if path in self.sheets or self.key(path) in ASSETS.sheets:
+            return
+        try:
+            info = archive.getinfo(path)
+        except KeyError:
+            raise BubbleLoaderError("BubbleLoader : L'archive ne contient pas la feuille de sprites " + path + ".")
+        # The CRC stored by the archive identifies the content of the member
+        # without reading it.
+        key = (path, info.CRC, info.file_size)
+        self.sheets[path] = DISK_CACHE.load(key, lambda: pygame.image.load(io.BytesIO(archive.read(path)), path))
+
+    def read(self):
+        with zipfile.ZipFile(self.file) as archive:
+            self.manifest = json.loads(archive.read("manifest.json").decode())
+            blocks_info = self.manifest.get('Blocks')
+            if blocks_info:
+                self.read_sheet(archive, blocks_info['Sprite sheet']['Path'])
+                if blocks_info.get('Layers file'):
+                    self.palette, self.grids = levelformat.decode(archive.read(blocks_info['Layers file']))
+            for i, c in enumerate(self.manifest.get('Characters', {}).get('Characters', [])):
+                self.read_character(archive, i, c)
+        return self
+
+    def read_character(self, archive, i, c):
+        """Read the definition of the i-th character declared by the
+        manifest, or the reasons why it can not be loaded."""
+        name = c.get('Name') if isinstance(c, dict) else None
+        if not isinstance(name, str) or not isinstance(c.get('Path'), str):
+            self.character_errors["#{}".format(i)] = ["declared without Name or Path"]
+            return
+        try:
+            data = archive.read(c['Path']).decode()
+        except KeyError:
+            self.character_errors[name] = ["no file " + c['Path']]
+            return
+        if not data.strip():
+            self.characters[name] = None
+            return
+        try:
+            description = json.loads(data)
+        except ValueError as e:
+            self.character_errors[name] = ["invalid JSON : " + str(e)]
+            return
+        errors = description_errors(description)
+        if not errors:
+            try:
+                self.read_sheet(archive, description['Sprite sheet'])
+            except BubbleLoaderError:
+                errors = ["no sprite sheet " + description['Sprite sheet']]
+        if errors:
+            self.character_errors[name] = errors
+            return
+        self.characters[name] = description
+
+    def sprite_sheet(self, path):
+        """SpriteSheet of the sheet at path, to be called by the main thread."""
+        if path not in self.sheets and self.key(path) not in ASSETS.sheets:
+            # Dropped from the cache since the level was read.
+            with zipfile.ZipFile(self.file) as archive:
+                self.read_sheet(archive, path)
+        return SpriteSheet(self.sheets.get(path), path, key=self.key(path))
+
+def read_level(filepath):
+    """LevelData of the archive at filepath."""
+    with PROFILER.phase("read level"):
+        return LevelData(filepath).read()
+
+class Preloader:
+
+    """Reads level archives in a worker thread.
+
+    request() starts reading a level and returns a future of its LevelData,
+    the levels already requested being shared until they are taken.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.pending = {}
+
+    def request(self, filepath):
+        key = os.path.abspath(filepath)
+        future = self.pending.get(key)
+        if future is None:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preloader")
+            future = self.pending[key] = self.executor.submit(read_level, filepath)
+        return future
+
+    def take(self, filepath):
+        """Future of the LevelData of filepath, which is forgotten by the
+        preloader (a level must be read again once it may have been saved)."""
+        future = self.request(filepath)
+        del self.pending[os.path.abspath(filepath)]
+        return future
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.pending.clear()
+
+PRELOADER = Preloader()
+
 class BubbleLoader(dict):
     def __init__(self, filepath, app):
         super().__init__(self)
         self.file = filepath
         self.objects = {}
         self.app = app
+        self.layers_file = None
+        self.next_level = None
+        self.save_thread = None
+        self.save_error = None
+        self.saving = None
 
-        self.tmp_dir = None
+    def read(self):
+        """Future of the LevelData of the level, read by the preloader."""
+        print("BubbleLoader : Lecture de l'archive.")
+        return PRELOADER.take(self.file)
 
-    def load(self):
-        self.tmp_dir = tempfile.TemporaryDirectory()
-        manifest = {}
-        print("BubbleLoader : Extraction de l'archive.")
-        with zipfile.ZipFile(self.file) as archive:
-            archive.extractall(self.tmp_dir.name)
+    def load(self, data=None):
+        """Install the level, from the LevelData read by read() if given,
+        and start reading the next level if there is one (the "Next level"
+        of the manifest, a path relative to the directory of the archive)."""
+        if data is None:
+            data = self.read().result()
+        with PROFILER.phase("load"):
+            manifest = data.manifest
 
-        with open(self.tmp_dir.name + "/manifest.json") as manifest_file:
-            manifest = json.loads(manifest_file.read())
+            if 'Blocks' in manifest.keys():
+                with PROFILER.phase("load blocks"):
+                    self.load_blocks(data, manifest['Blocks'])
+            else:
+                print("BubbleLoader : Le niveau ne semble pas contenir de blocks.")
 
-        if 'Blocks' in manifest.keys():
-            self.load_blocks(manifest['Blocks'])
-        else:
-            print("BubbleLoader : Le niveau ne semble pas contenir de blocks.")
+            if 'Characters' in manifest.keys():
+                with PROFILER.phase("load characters"):
+                    self.create_characters_types(data, manifest['Characters'])
+                    self.place_characters(manifest['Characters'])
 
-        self.tmp_dir.cleanup()
+        self.next_level = None
+        if manifest.get('Next level'):
+            self.next_level = os.path.join(os.path.dirname(self.file), manifest['Next level'])
+            PRELOADER.request(self.next_level)
 
-    def create_characters_types(self):
-        pass
+    def create_characters_types(self, data, characters_info):
+        print("BubbleLoader : Chargement des personnages.")
+        for name, errors in data.character_errors.items():
+            print("BubbleLoader : Le personnage " + name + " est ignoré : " + ", ".join(errors) + ".")
+        for c in characters_info.get('Characters', []):
+            name = c.get('Name') if isinstance(c, dict) else None
+            if not isinstance(name, str) or name not in data.characters:
+                continue
+            description = data.characters[name]
+            if description is None:
+                print("BubbleLoader : Le personnage " + name + " n'est pas décrit.")
+                continue
+            sprite_sheet = data.sprite_sheet(description['Sprite sheet'])
+            self.app.entities.add_type(CharacterType(name, sprite_sheet, description))
 
-    def load_blocks(self,blocks_info):
-        if not self.tmp_dir:
-            raise BubbleLoaderError("BubbleLoader : Il n'y a pas de dossier temporaire pour l'extraction des sprites.")
+    def place_characters(self, characters_info):
+        entities = self.app.entities
+        entities.clear()
+        for p in characters_info.get('Places', []):
+            if not isinstance(p, dict) or not isinstance(p.get('Name'), str) or \
+                    not all(isinstance(p.get(k), int) for k in ('x', 'y')):
+                print("BubbleLoader : Un placement de personnage est incomplet, il est ignoré.")
+                continue
+            if p['Name'] not in entities.type_ids:
+                continue
+            entities.add(p['Name'], (p['x'], p['y']), p.get('left_displacement', 0), p.get('right_displacement', 0))
 
+    def load_blocks(self, data, blocks_info):
         print("BubbleLoader : Chargement des images de blocks.")
-        sprite_sheet = SpriteSheet(self.tmp_dir.name + '/' + blocks_info['Sprite sheet']['Path'])
-        Block.SPRITES_DESC = blocks_info['Sprite sheet']
+        sprite_sheet = data.sprite_sheet(blocks_info['Sprite sheet']['Path'])
+        types = self.app.block_types
+        types.clear()
+        types.description = blocks_info['Sprite sheet']
         for o_type in blocks_info['Sprite sheet']['Sprites description']:
             rect = (o_type['x'], o_type['y'], o_type['width'], o_type['height'])
-            Block.SPRITES[o_type['Name']] = sprite_sheet.image_at(rect).convert_alpha()
+            types.add(o_type['Name'], sprite_sheet.image_at(rect))
 
         print("BubbleLoader : Placement des blocks.")
-        for b in blocks_info['Background blocks']:
-            pos = (b['x'], b['y'])
-            self.app.background[pos] = Block(pos, image=b['Type'])
+        self.layers_file = blocks_info.get('Layers file')
+        if self.layers_file:
+            for name, layer in self.get_layers().items():
+                if name in data.grids:
+                    layer.load_grid(data.grids[name], data.palette)
+        else:
+            for name, layer in self.get_layers().items():
+                layer.load(blocks_info.get(name, []))
+        for layer in self.get_layers().values():
+            layer.modified = False
 
-        for b in blocks_info['Foreground blocks']:
-            pos = (b['x'], b['y'])
-            self.app.foreground[pos] = Block(pos, image=b['Type'])
-        for b in blocks_info['Middleground blocks']:
-            pos = (b['x'], b['y'])
-            self.app.middleground[pos] = Block(pos, image=b['Type'])
+    def get_layers(self):
+        return {
+            "Foreground blocks": self.app.foreground,
+            "Background blocks": self.app.background,
+            "Middleground blocks": self.app.middleground,
+        }
 
     def get_blocks_to_save(self):
-        d = {"Foreground blocks":[], "Background blocks":[], "Middleground blocks":[]}
-        for b in self.app.background.values():
-            d["Background blocks"].append(b.as_dict())
-        for b in self.app.foreground.values():
-            d["Foreground blocks"].append(b.as_dict())
-        for b in self.app.middleground.values():
-            d["Middleground blocks"].append(b.as_dict())
-        return d
-
-    def save(self):
-        self.tmp_dir = tempfile.TemporaryDirectory()
-        print("BubbleLoader : Extraction de l'archive.")
-        with zipfile.ZipFile(self.file) as archive:
-            archive.extractall(self.tmp_dir.name)
-
-        with open(self.tmp_dir.name + "/manifest.json") as manifest_file:
-            manifest = json.loads(manifest_file.read())
+        return {name: layer.as_list() for name, layer in self.get_layers().items()}
 
+    def save(self, background=False):
+        """Write the blocks to the archive, if they changed since the last
+        load or save. With background, the archive is written by a thread
+        and the blocks are only copied in the calling one."""
+        self.wait_save()
+        layers = self.get_layers().values()
+        if not any(l.modified for l in layers):
+            print("BubbleLoader : Rien à sauvegarder.")
+            return
         print("BubbleLoader : Sauvegarde des Blocks.")
         blocks = self.get_blocks_to_save()
-        manifest['Blocks']["Foreground blocks"] = blocks["Foreground blocks"]
-        manifest['Blocks']["Background blocks"] = blocks["Background blocks"]
-        manifest['Blocks']["Middleground blocks"] = blocks["Middleground blocks"]
-
-
-        print("BubbleLoader : Création de l'archive")
-        with open(self.tmp_dir.name + '/manifest.json', 'w') as manifest_file:
-            manifest_file.write(json.dumps(manifest))
+        # The layers are only marked as saved once the archive is written,
+        # and if they did not change in the meantime.
+        self.saving = [(l, l.revision) for l in layers]
+        if background:
+            self.save_thread = threading.Thread(target=self.run_save, args=(blocks,))
+            self.save_thread.start()
+        else:
+            self.write_blocks(blocks)
+            self.saved()
 
-        archive = zipfile.ZipFile(self.file, 'w')
-        curdir = os.getcwd()
-        os.chdir(self.tmp_dir.name)
-        for root, dirs, files in os.walk(os.curdir):
-            for f in files:
-                archive.write(os.path.join(root, f))
-        os.chdir(curdir)
-        archive.close()
+    def run_save(self, blocks):
+        try:
+            self.write_blocks(blocks)
+        except Exception as e:
+            self.save_error = e
 
-        self.tmp_dir.cleanup()
+    def saved(self):
+        for l, revision in self.saving:
+            if l.revision == revision:
+                l.modified = False
+        self.saving = None
 
+    def save_done(self):
+        """Whether no background save is running."""
+        return self.save_thread is None or not self.save_thread.is_alive()
 
+    def wait_save(self):
+        """Wait for the end of a background save, raising its exception if
+        it failed."""
+        if self.save_thread:
+            self.save_thread.join()
+            self.save_thread = None
+            error, self.save_error = self.save_error, None
+            if error is not None:
+                self.saving = None
+                raise error
+            self.saved()
 
+    def write_blocks(self, blocks):
+        with PROFILER.phase("save"), zipfile.ZipFile(self.file) as archive:
+            manifest = json.loads(archive.read("manifest.json").decode())
 
+        if self.layers_file:
+            blocks_info = dict(manifest['Blocks'], **blocks)
+            members = {self.layers_file: levelformat.to_binary(blocks_info)}
+        else:
+            manifest['Blocks'].update(blocks)
+            members = {"manifest.json": json.dumps(manifest).encode()}
 
+        print("BubbleLoader : Création de l'archive")
+        rewrite_archive(self.file, members)
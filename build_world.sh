@@ -3,4 +3,6 @@
 rm test.zip
 cd world/
 zip -r test.zip ./*
-mv test.zip ../
\ No newline at end of file
+mv test.zip ../
+cd ..
+python3 levelcheck.py test.zip > /dev/null
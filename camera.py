@@ -0,0 +1,26 @@
+import pygame
+from pygame.locals import *
+
+class Camera:
+
+    """The part of the world which is shown in the window."""
+
+    def __init__(self, pos, size):
+        self.rect = pygame.Rect(pos, size)
+
+    def apply(self, pos):
+        """World position to screen position."""
+        return (pos[0] - self.rect.x, pos[1] - self.rect.y)
+
+    def to_world(self, pos):
+        """Screen position to world position."""
+        return (pos[0] + self.rect.x, pos[1] + self.rect.y)
+
+    def move(self, dx, dy):
+        self.rect.x = max(0, self.rect.x + dx)
+        self.rect.y = max(0, self.rect.y + dy)
+
+    def follow(self, rect):
+        """Center the camera on rect, without going past the world origin."""
+        self.rect.x = max(0, rect.centerx - self.rect.w // 2)
+        self.rect.y = max(0, rect.centery - self.rect.h // 2)
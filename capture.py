@@ -0,0 +1,174 @@
+"""Export of the rendered frames, for gameplay capture.
+
+A FrameExporter copies each frame of the window, straight from its pixel
+buffer, into one of a few preallocated buffers, and a background thread hands
+the buffers to a sink : RawSink (raw pixels in a file, described by a JSON
+file next to it), PngSink (a PNG image per frame) or PipeSink (raw pixels
+written to the standard input of a command). When the sink is too slow and
+no buffer is free, frames are dropped instead of slowing the game down.
+
+Raw pixels are the ones of the window, 4 bytes per pixel in the order given
+by its masks, usually B, G, R and an unused byte. For instance, with ffmpeg :
+    PipeSink("ffmpeg -f rawvideo -pix_fmt bgr0 -s 600x600 -r 20 -i - capture.mp4")
+"""
+
+import os
+import abc
+import json
+import queue
+import threading
+import subprocess
+
+import pygame
+from pygame.locals import *
+
+class FrameSink(abc.ABC):
+
+    """Destination of the exported frames, written by the exporter thread."""
+
+    def open(self, size, pitch, masks):
+        """Called once, before the first frame, with the size, the bytes per
+        row and the color masks of the frames."""
+        self.size = size
+        self.pitch = pitch
+        self.masks = masks
+
+    @abc.abstractmethod
+    def write(self, index, data):
+        """Write frame number index (frames can be missing), data being a
+        buffer only valid during the call."""
+
+    def close(self):
+        pass
+
+class RawSink(FrameSink):
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = []
+
+    def open(self, size, pitch, masks):
+        super().open(size, pitch, masks)
+        self.file = open(self.path, 'wb')
+
+    def write(self, index, data):
+        self.file.write(data)
+        self.frames.append(index)
+
+    def close(self):
+        self.file.close()
+        with open(self.path + ".json", 'w') as f:
+            json.dump({"size": self.size, "pitch": self.pitch, "masks": self.masks, "frames": self.frames}, f)
+
+class PngSink(FrameSink):
+
+    def __init__(self, directory, pattern="frame_{:06}.png"):
+        self.directory = directory
+        self.pattern = pattern
+
+    def open(self, size, pitch, masks):
+        super().open(size, pitch, masks)
+        os.makedirs(self.directory, exist_ok=True)
+        self.image = pygame.Surface(size, 0, 32, masks)
+
+    def write(self, index, data):
+        with memoryview(self.image.get_view('0')) as pixels:
+            pixels[:] = data
+        pygame.image.save(self.image, os.path.join(self.directory, self.pattern.format(index)))
+
+class PipeSink(FrameSink):
+
+    def __init__(self, command):
+        self.command = command
+
+    def open(self, size, pitch, masks):
+        super().open(size, pitch, masks)
+        self.process = subprocess.Popen(self.command, shell=True, stdin=subprocess.PIPE)
+
+    def write(self, index, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+class FrameExporter:
+
+    """Streams the frames of a surface to a sink, from a background thread.
+
+    capture() only copies the pixels into a free buffer, the buffers in use
+    (at most buffers of them) being written by the thread. dropped counts
+    the frames lost because the sink was late. An exception of the sink
+    stops the thread and is raised again by the next capture() or by
+    close().
+    """
+
+    def __init__(self, sink, buffers=4):
+        self.sink = sink
+        self.buffers = buffers
+        self.free = None
+        self.frames = queue.Queue()
+        self.thread = None
+        self.index = 0
+        self.dropped = 0
+        self.error = None
+
+    def start(self, surface):
+        if surface.get_bytesize() != 4:
+            raise ValueError("FrameExporter : Seules les surfaces 32 bits peuvent être exportées.")
+        size = surface.get_pitch() * surface.get_height()
+        self.free = queue.Queue()
+        for _ in range(self.buffers):
+            self.free.put(bytearray(size))
+        self.sink.open(surface.get_size(), surface.get_pitch(), surface.get_masks())
+        # A daemon, not to keep a crashed game from exiting.
+        self.thread = threading.Thread(target=self.run, name="frame exporter", daemon=True)
+        self.thread.start()
+
+    def capture(self, surface):
+        """Queue the current pixels of surface, or drop them if the sink is
+        late."""
+        if self.thread is None:
+            self.start(surface)
+        self.raise_error()
+        index = self.index
+        self.index += 1
+        try:
+            buffer = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        with memoryview(surface.get_view('0')) as pixels:
+            buffer[:] = pixels
+        self.frames.put((index, buffer))
+
+    def run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                index, buffer = frame
+                self.sink.write(index, buffer)
+                self.free.put(buffer)
+        except BaseException as e:
+            self.error = e
+
+    def raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Write the queued frames and close the sink, raising the
+        exception of the sink if it failed."""
+        if self.thread is None:
+            return
+        self.frames.put(None)
+        self.thread.join()
+        self.thread = None
+        try:
+            self.sink.close()
+        finally:
+            self.raise_error()
+        print("FrameExporter : {} images, {} perdues.".format(self.index, self.dropped))
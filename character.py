@@ -1,17 +1,19 @@
 import pygame
 from pygame.locals import *
 
-from sprites import SpriteSheet, Animation, TimedAnimation
-from block import Block, get_equivalent_block_pos, test_in_rect
+from sprites import SpriteSheet, FrameTable, ANIMATIONS
+from block import EMPTY
+from broadphase import Contact, SpatialGrid, side_of
+from tilequery import TileQuery, TileHit
 
 class CollideDirection:
     def __init__(self, **kwargs):
         """args :
-            - top : bool
-            - bottom : bool
-            - left : bool
-            - right : bool
-            - center : bool
+            - top : position of a solid tile touching the top, or None
+            - bottom : same for the bottom
+            - left : same for the left
+            - right : same for the right
+            - center : position of a solid tile overlapped, or None
         """
         self.left = kwargs.get("left", None)
         self.right = kwargs.get("right", None)
@@ -21,31 +23,38 @@ class CollideDirection:
 
 class Collider:
 
+    """Collisions of the objects with the middleground and between them.
+
+    The solid tiles touching the objects come from the tile ids of the
+    middleground (see TileQuery), which the objects also use to move.
+    """
+
     def __init__(self, app):
         self.app = app
+        self.tiles = TileQuery(app.middleground)
+        self.grid = SpatialGrid()
+        self.contacts = []
+
+    def collide_objects(self):
+        """Contacts between objects whose masks overlap, in both directions."""
+        self.grid.rebuild(self.app.objects)
+        contacts = []
+        for a, b in self.grid.pairs():
+            point = b.mask.overlap(a.mask, (a.rect.x - b.rect.x, a.rect.y - b.rect.y))
+            if point:
+                contacts.append(Contact(a, b, point, side_of(a.rect, b.rect)))
+                point = a.mask.overlap(b.mask, (b.rect.x - a.rect.x, b.rect.y - a.rect.y))
+                contacts.append(Contact(b, a, point, side_of(b.rect, a.rect)))
+        return contacts
 
     def collide(self):
         for o in self.app.objects:
-            eq = get_equivalent_block_pos((o.rect.x, o.rect.y))
-            to_be_tested = {
-                (eq[0]-Block.BLOCK_SIZE, eq[1]): "left",
-                #(eq[0]-2*Block.BLOCK_SIZE, eq[1]): "left",
-                (eq[0]+Block.BLOCK_SIZE, eq[1]): "right",
-                #(eq[0]+2*Block.BLOCK_SIZE, eq[1]): "right",
-                (eq[0], eq[1]-Block.BLOCK_SIZE): "top",
-                #(eq[0], eq[1]-2*Block.BLOCK_SIZE): "top",
-                (eq[0], eq[1]+Block.BLOCK_SIZE): "bottom",
-                #(eq[0], eq[1]+2*Block.BLOCK_SIZE): "bottom",
-                (eq[0], eq[1]): "center"
-            }
-
-            c = {"left":None,"right":None,"top":None,"bottom":None, "center":None}
-            for p in to_be_tested:
-                b = self.app.middleground.get(p, None)
-                if not b:
-                    continue
-                c[to_be_tested[p]] = (pygame.sprite.collide_mask(b, o), b)
-            o.collide = CollideDirection(**c)
+            o.tiles = self.tiles
+            self.tiles.touching(o.rect, o.collide)
+            o.contacts.clear()
+        self.contacts = self.collide_objects()
+        for c in self.contacts:
+            c.obj.contacts.append(c)
 
 class Character(pygame.sprite.Sprite):
 
@@ -73,7 +82,11 @@ class Character(pygame.sprite.Sprite):
     def __init__(self, pos):
         self.image = pygame.Surface((0, 0))
         self.rect = self.image.get_rect()
+        self.mask = pygame.mask.from_surface(self.image)
+        self.solidity = EMPTY
         self.rect.x, self.rect.y = pos
+        self.previous = pos
+        self.tick = 0
 
         self.v_y = 0
 
@@ -81,80 +94,144 @@ class Character(pygame.sprite.Sprite):
         self.movement = self.MOTIONLESS
 
         self.collide = CollideDirection()
-
-    def on_render(self, dst):
-        dst.blit(self.image)
+        self.contacts = []
+        self.tiles = None
+        self.hit = TileHit()
+
+    def interpolated_pos(self, alpha):
+        """Position between the previous and the current one."""
+        x, y = self.previous
+        return (round(x + (self.rect.x - x) * alpha), round(y + (self.rect.y - y) * alpha))
+
+    def frame(self, alpha=1):
+        """(image, position) to draw for this frame."""
+        return self.image, self.interpolated_pos(alpha)
+
+    def on_render(self, dst, camera, alpha=1):
+        image, pos = self.frame(alpha)
+        return dst.blit(image, camera.apply(pos))
+
+    def move(self, dx, dy):
+        """Move by dx and then dy, stopping at the solid tiles of the
+        middleground. Returns the TileHit of the move."""
+        hit = self.hit
+        if self.tiles is None:
+            hit.dx, hit.dy, hit.x_tile, hit.y_tile = dx, dy, None, None
+        else:
+            self.tiles.sweep(self.rect, dx, dy, hit)
+        self.rect.move_ip(hit.dx, hit.dy)
+        return hit
 
     def move_right(self):
         if self.collide.right:
             return
-        self.rect.x += self.X_DISPLACEMENT
+        self.move(self.X_DISPLACEMENT, 0)
 
     def move_left(self):
         if self.collide.left:
             return
-        self.rect.x -= self.X_DISPLACEMENT
+        self.move(-self.X_DISPLACEMENT, 0)
 
     def jump(self):
         if self.collide.bottom:
             self.v_y = self.Y_SPEED
-            self.rect.y += self.v_y
+            self.move(0, self.v_y)
 
     def gravity(self):
-        if not self.collide.bottom:
-            self.rect.y += self.v_y
-            self.v_y = self.v_y+self.Y_DISPLACEMENT
-        elif self.collide.bottom[0]:
+        if self.collide.bottom and self.v_y >= 0:
             self.v_y = 0
-            self.rect.y = self.collide.bottom[1].rect.y - self.collide.bottom[0][1] - Block.BLOCK_SIZE
+            return
+        if self.move(0, self.v_y).y_tile is not None:
+            # Landed, or bumped the head.
+            self.v_y = 0
+        else:
+            self.v_y = min(self.v_y + self.Y_DISPLACEMENT, abs(self.Y_SPEED_MAX))
 
     def on_update(self):
+        self.tick += 1
+        self.previous = (self.rect.x, self.rect.y)
         self.gravity()
 
     def get_mask(self):
-        return pygame.mask.from_surface(self.image)
-
+        return self.mask
+
+
+# (y of the row in the sprite sheet, frames, delay in simulation ticks) of
+# the animations of the player, indexed by direction + movement.
+PLAYER_ANIMATIONS = (
+    (0, 1, 1),
+    (32, 1, 1),
+    (64, 7, 1),
+    (96, 7, 1),
+    (128, 4, 1),
+    (160, 4, 1),
+    (192, 1, 1),
+    (224, 1, 1),
+    (256, 1, 1),
+    (288, 1, 1),
+    (320, 2, 16),
+    (352, 2, 16),
+)
 
 class Player(Character):
 
-    """The main character."""
+    """The main character.
+
+    Its animation is the id of a shared FrameTable and the tick at which it
+    started, the frame shown being computed from its simulation tick.
+    """
+
+    SPRITE_SHEET = 'main_char.png'
 
     def __init__(self, pos):
         Character.__init__(self, pos)
-        sprite_sheet = SpriteSheet('main_char.png')
-
-
-        self.anims = (
-            Animation(sprite_sheet.images_at((0, 0, 32, 32), 1)),
-            Animation(sprite_sheet.images_at((0, 32, 32, 32), 1)),
-            TimedAnimation(sprite_sheet.images_at((0, 64, 32, 32), 7), 50),
-            TimedAnimation(sprite_sheet.images_at((0, 96, 32, 32), 7), 50),
-            Animation(sprite_sheet.images_at((0, 128, 32, 32), 4)),
-            Animation(sprite_sheet.images_at((0, 160, 32, 32), 4)),
-            Animation(sprite_sheet.images_at((0, 192, 32, 32), 1)),
-            Animation(sprite_sheet.images_at((0, 224, 32, 32), 1)),
-            Animation(sprite_sheet.images_at((0, 256, 32, 32), 1)),
-            Animation(sprite_sheet.images_at((0, 288, 32, 32), 1)),
-            TimedAnimation(sprite_sheet.images_at((0, 320, 32, 32), 2), 1000),
-            TimedAnimation(sprite_sheet.images_at((0, 352, 32, 32), 2), 1000),
-        )
+        self.anims = tuple(self.animation(y, nb, delay) for y, nb, delay in PLAYER_ANIMATIONS)
+        self.anim = None
+        self.anim_start = 0
+        # Whether a direction is held, the player moving that way on the
+        # ground and in the air.
+        self.running = False
+        self.change_anim(self.movement, self.direction)
+
+    @classmethod
+    def animation(cls, y, nb, delay=1):
+        """Id of the animation of the nb frames of the row at y, whose frame
+        table is made by the first player and shared by the next ones."""
+        rect = (0, y, 32, 32)
+        return ANIMATIONS.get((cls.SPRITE_SHEET, rect, nb, delay),
+                              lambda: FrameTable(SpriteSheet(cls.SPRITE_SHEET).images_at(rect, nb), delay))
+
     def change_anim(self, mov, dir):
-        self.anims[self.direction + self.movement].stop()
         self.movement = mov
         self.direction = dir
+        self.anim = self.anims[self.direction + self.movement]
+        self.anim_start = self.tick
+        self.rect.size = ANIMATIONS.tables[self.anim].size
+        self.update_image()
     def change_direction(self, dir):
         if dir is not self.direction:
             self.change_anim(self.movement, dir)
 
+    def airborne(self):
+        return self.movement in (self.JUMPING, self.FALLING)
+
+    def run(self, running):
+        """Start or stop running, the animation only changing on the
+        ground."""
+        self.running = running
+        if not self.airborne():
+            self.change_movement(self.RUNNING if running else self.MOTIONLESS)
+
     def on_update(self):
         super(Player, self).on_update()
-        if self.movement == self.RUNNING:
+        if self.running:
             if self.direction == self.RIGHT:
                 self.move_right()
             else:
                 self.move_left()
         if self.v_y > 0:
-            self.movement = self.FALLING
+            self.change_movement(self.FALLING)
+        self.update_image()
 
     def change_movement(self, mov):
         if mov is not self.movement:
@@ -167,17 +244,18 @@ class Player(Character):
 
     def gravity(self):
         super(Player, self).gravity()
-        if self.movement == Character.JUMPING and self.v_y==0:
-            self.change_movement(Character.MOTIONLESS)
-
-    def on_render(self, dst):
-        self.image = self.anims[self.direction + self.movement].current_image()
-        x,y = self.rect.x, self.rect.y
-        self.rect = self.image.get_rect()
-        self.rect.x, self.rect.y = x,y
-        dst.blit(self.image, (self.rect.x, self.rect.y))
-        self.anims[self.direction + self.movement].next()
+        if self.airborne() and self.v_y==0:
+            # Top of the jump, or landed.
+            self.change_movement(self.RUNNING if self.running else self.MOTIONLESS)
+
+    def update_image(self):
+        """Take the image, mask and solidity of the animation frame of the
+        current tick."""
+        table = ANIMATIONS.tables[self.anim]
+        i = table.index_at(self.tick - self.anim_start)
+        self.image = table.images[i]
+        self.mask = table.masks[i]
+        self.solidity = table.solidities[i]
 
     def get_mask(self):
-        s = self.anims[self.direction + self.movement].current_image()
-        return pygame.mask.from_surface(s)
+        return self.mask
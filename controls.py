@@ -0,0 +1,102 @@
+"""Keyboard input, snapshotted once per simulation tick.
+
+The state of the game actions in a tick is a bitset of LEFT, RIGHT, JUMP and
+DEAD : the actions held, and the ones pressed since the previous tick. Live
+play and replayed input scripts (see headless.py) both drive the player with
+apply().
+"""
+
+import json
+
+import pygame
+from pygame.locals import *
+
+from character import Player
+
+LEFT = 1
+RIGHT = 2
+JUMP = 4
+DEAD = 8
+
+ACTIONS = {"left": LEFT, "right": RIGHT, "jump": JUMP, "dead": DEAD}
+
+KEYS = (
+    (K_LEFT, LEFT),
+    (K_RIGHT, RIGHT),
+    (K_UP, JUMP),
+    (K_d, DEAD),
+)
+
+def bits_of(names):
+    bits = 0
+    for n in names:
+        bits |= ACTIONS[n]
+    return bits
+
+def names_of(bits):
+    return [n for n, b in ACTIONS.items() if bits & b]
+
+def apply(player, held, pressed):
+    """Drive the player with the actions held and pressed in a tick."""
+    if held & LEFT:
+        player.change_direction(Player.LEFT)
+        player.run(True)
+    elif held & RIGHT:
+        player.change_direction(Player.RIGHT)
+        player.run(True)
+    else:
+        player.run(False)
+    if pressed & JUMP:
+        player.jump()
+    if pressed & DEAD:
+        player.change_movement(Player.DEAD)
+
+class Controls:
+
+    """Actions of the keyboard, tick after tick.
+
+    The keyboard state is read once per frame by the caller, and turned into
+    the bitsets of each tick by snapshot(). Keys pressed and released between
+    two ticks are not lost, as their KEYDOWN events are latched by key_down().
+    The ticks can be recorded as an input script.
+    """
+
+    def __init__(self, keys=KEYS):
+        self.keys = keys
+        self.actions = dict(keys)
+        self.held = 0
+        self.latched = 0
+        self.tick = 0
+        self.recording = None
+
+    def key_down(self, key):
+        self.latched |= self.actions.get(key, 0)
+
+    def snapshot(self, keys):
+        """(held, pressed) bitsets of the next tick, keys being the result of
+        pygame.key.get_pressed()."""
+        held = 0
+        for k, b in self.keys:
+            if keys[k]:
+                held |= b
+        pressed = (held & ~self.held) | self.latched
+        released = (self.held | pressed) & ~held
+        if self.recording is not None and (pressed or released):
+            self.recording.append({"tick": self.tick, "press": names_of(pressed), "release": names_of(released)})
+        self.held = held
+        self.latched = 0
+        self.tick += 1
+        return held, pressed
+
+    def start_recording(self):
+        """Record the ticks from now on, the first one being tick 0."""
+        self.recording = []
+        self.tick = 0
+        # Keys already held are recorded as pressed at tick 0.
+        self.held = 0
+
+    def stop_recording(self, path):
+        """Stop recording and write the input script to path."""
+        with open(path, 'w') as f:
+            json.dump(self.recording or [], f, indent=1)
+        self.recording = None
@@ -4,11 +4,19 @@ import pygame
 from pygame.locals import *
 
 
-from app import App, UPDATE_SPRITES_EVENT
+from app import App
 from character import Player
-from block import Block, get_equivalent_block_pos, test_in_rect
+from block import Block, get_equivalent_block_pos, test_in_rect, blocks_between
 from bubbleLoader import BubbleLoader
+from journal import EditJournal
+from minimap import Minimap, MINIMAP_SIZE
+from levelformat import Grid
+from assets import ASSETS
 
+AUTOSAVE_DELAY = 10000
+SCROLL_STEP = 3 * Block.BLOCK_SIZE
+SELECTION_COLOR = (0,120,255)
+PASTE_COLOR = (255,160,0)
 
 class Editor(App):
     def __init__(self):
@@ -17,20 +25,89 @@ class Editor(App):
 
         self.objects = {}
 
+        layers = {"Background": self.background, "Middleground": self.middleground, "Foreground": self.foreground}
+        self.journal = EditJournal(layers, self.loader.file + ".journal")
+        self.journal.replay()
+        # Milliseconds since the last autosave, counted by the clock of the
+        # main loop.
+        self.since_autosave = 0
+        self.saving = False
+        self.drag_start = None
+        self.select_start = None
+        self.pan_start = None
+        # Rect of blocks (x, y, width, height) and copied blocks, a list of
+        # (layer, Grid, palette), layer None standing for the current one.
+        self.selection = None
+        self.clipboard = None
+
         self.current_layer = "Middleground"
         x,y = self.window.get_width() - Block.BLOCK_SIZE - 20, 0
         w,h = Block.BLOCK_SIZE + 20, self.window.get_height()
-        self.menu = SideMenu((x,y), (w,h))
+        self.menu = SideMenu((x,y), (w,h), self.block_types.sprites)
+        self.minimap = Minimap([self.background, self.middleground, self.foreground],
+                               (0, self.window.get_height() - MINIMAP_SIZE[1]))
+        self.show_minimap = True
+
+    def screen_rect(self, rect):
+        """Window rect of a rect of blocks."""
+        s = Block.BLOCK_SIZE
+        return pygame.Rect(self.camera.apply((rect[0] * s, rect[1] * s)), (rect[2] * s, rect[3] * s))
 
-        self.font = pygame.font.Font(None, 32)
+    def paste_rect(self):
+        """Rect of blocks the clipboard would be pasted on, at the mouse."""
+        s = Block.BLOCK_SIZE
+        x, y = self.camera.to_world(pygame.mouse.get_pos())
+        x, y = x // s, y // s
+        grid = self.clipboard[0][1]
+        return (x, y, grid.width, grid.height)
+
+    def has_overlay(self):
+        return True
 
-    def on_render(self):
-        super().on_render()
+    def on_render_overlay(self):
+        if self.selection:
+            pygame.draw.rect(self.window, SELECTION_COLOR, self.screen_rect(self.selection), 2)
+        if self.clipboard:
+            pygame.draw.rect(self.window, PASTE_COLOR, self.screen_rect(self.paste_rect()), 1)
         self.menu.on_render(self.window)
-        txt = self.font.render(self.current_layer, True, (0,0,0))
+        if self.show_minimap:
+            self.minimap.update()
+            self.minimap.on_render(self.window, self.camera)
+        txt = ASSETS.text(self.current_layer, 32, (0,0,0))
         self.window.blit(txt, (0,0))
 
+    def copy(self, all_layers=False):
+        """Copy the blocks of the selection, of the current layer or of
+        all of them."""
+        if not self.selection:
+            return
+        names = self.journal.layers if all_layers else [self.current_layer]
+        self.clipboard = [(n if all_layers else None,) + self.journal.layers[n].read_grid(*self.selection)
+                          for n in names]
+
+    def paste(self):
+        x, y, w, h = self.paste_rect()
+        grids = []
+        for layer, grid, palette in self.clipboard:
+            grid = Grid(x, y, w, h, grid.ids)
+            grids.append((layer or self.current_layer, grid, palette))
+        self.journal.paste(grids)
+        self.selection = (x, y, w, h)
+
+    def erase_selection(self):
+        if self.selection:
+            x, y, w, h = self.selection
+            self.journal.paste([(self.current_layer, Grid(x, y, w, h), [])])
+
     def on_event(self, e):
+        if e.type in (KEYDOWN, MOUSEBUTTONDOWN, MOUSEBUTTONUP, MOUSEWHEEL):
+            self.renderer.invalidate()
+        elif e.type == MOUSEMOTION:
+            if self.pan_start is not None:
+                self.camera.move(self.pan_start[0] - e.pos[0], self.pan_start[1] - e.pos[1])
+                self.pan_start = e.pos
+            if self.select_start is not None or self.clipboard:
+                self.renderer.invalidate()
         if e.type == QUIT:
             self.running = False
         elif e.type == KEYDOWN:
@@ -44,62 +121,125 @@ class Editor(App):
                 self.current_layer = "Middleground"
             elif e.key == K_f:
                 self.current_layer = "Foreground"
+            elif e.key == K_z and e.mod & KMOD_CTRL:
+                self.journal.undo()
+            elif e.key == K_y and e.mod & KMOD_CTRL:
+                self.journal.redo()
+            elif e.key == K_c and e.mod & KMOD_CTRL:
+                self.copy(all_layers=e.mod & KMOD_SHIFT)
+            elif e.key == K_x and e.mod & KMOD_CTRL:
+                self.copy()
+                self.erase_selection()
+            elif e.key == K_v and e.mod & KMOD_CTRL:
+                if self.clipboard:
+                    self.paste()
+            elif e.key == K_TAB:
+                self.show_minimap = not self.show_minimap
+            elif e.key == K_DELETE:
+                self.erase_selection()
+            elif e.key == K_BACKSPACE:
+                self.selection = None
+                self.clipboard = None
             elif e.key == K_s:
-                self.loader.save()
-        elif e.type == UPDATE_SPRITES_EVENT:
-            for o in self.objects:
-                o.on_update()
+                self.save()
+        elif e.type == MOUSEWHEEL:
+            if test_in_rect(self.menu.pos + self.menu.size, pygame.mouse.get_pos()):
+                self.menu.scroll(-e.y)
+            else:
+                self.camera.move(e.x * SCROLL_STEP, -e.y * SCROLL_STEP)
         elif e.type == MOUSEBUTTONDOWN:
-            if self.menu.test_click(e.pos):
+            if e.button == 2:
+                self.pan_start = e.pos
+                return
+            if e.button not in (1, 3) or self.menu.test_click(e.pos):
                 return
-            eq = get_equivalent_block_pos(e.pos)
-            if e.button == 3:
-                if self.current_layer == "Background":
-                    self.background.pop(eq, None)
-                elif self.current_layer == "Middleground":
-                    self.middleground.pop(eq, None)
-                elif self.current_layer == "Foreground":
-                    self.foreground.pop(eq, None)
+            if self.show_minimap and self.minimap.rect.collidepoint(e.pos):
+                pos = self.minimap.to_world(e.pos)
+                if pos:
+                    self.camera.follow(pygame.Rect(pos, (0, 0)))
                 return
-            if self.current_layer == "Background":
-                self.background[eq] = Block(eq,self.menu.get_current())
-            if self.current_layer == "Middleground":
-                self.middleground[eq] = Block(eq,self.menu.get_current())
-            if self.current_layer == "Foreground":
-                self.foreground[eq] = Block(eq,self.menu.get_current())
+            eq = get_equivalent_block_pos(self.camera.to_world(e.pos))
+            name = self.menu.get_current() if e.button == 1 else None
+            mod = pygame.key.get_mods()
+            if mod & KMOD_ALT:
+                # Selection, set when the button is released.
+                self.select_start = eq
+            elif mod & KMOD_SHIFT:
+                # Rectangle, filled when the button is released.
+                self.drag_start = eq
+            elif mod & KMOD_CTRL:
+                self.journal.flood_fill(self.current_layer, eq, name, self.camera.rect)
+            else:
+                self.journal.paint(self.current_layer, [eq], name)
+        elif e.type == MOUSEBUTTONUP:
+            if e.button == 2:
+                self.pan_start = None
+                return
+            if self.select_start is not None:
+                self.selection = blocks_between(self.select_start, self.camera.to_world(e.pos))
+                self.select_start = None
+                return
+            if self.drag_start is None or e.button not in (1, 3):
+                return
+            eq = get_equivalent_block_pos(self.camera.to_world(e.pos))
+            name = self.menu.get_current() if e.button == 1 else None
+            self.journal.rect(self.current_layer, self.drag_start, eq, name)
+            self.drag_start = None
 
     def on_mainloop(self):
         self.running = True
 
         while self.running:
-            self.window.fill((200,200,200))
-            if not pygame.event.peek(KEYDOWN):
-                self.player.change_movement(Player.MOTIONLESS)
-
+            self.stream_layers()
             for e in pygame.event.get():
                 self.on_event(e)
-            self.on_render()
-            pygame.display.flip()
-            pygame.time.Clock().tick(20)
+            self.check_save()
+            # The journal file is left alone while the level is being saved.
+            if self.since_autosave > AUTOSAVE_DELAY and not self.saving:
+                self.journal.autosave()
+                self.since_autosave = 0
+            self.renderer.render()
+            self.since_autosave += self.clock.tick(self.frame_rate)
+
+    def save(self):
+        """Save the level in the background, the journal being forgotten
+        once it succeeded (see check_save)."""
+        self.check_save(wait=True)
+        self.journal.autosave()
+        self.loader.save(background=True)
+        self.saving = True
+
+    def check_save(self, wait=False):
+        """Forget the journal if the save is over and succeeded, keep it if
+        it failed. With wait, wait for the end of the save."""
+        if not self.saving or not (wait or self.loader.save_done()):
+            return
+        self.saving = False
+        try:
+            self.loader.wait_save()
+        except Exception as e:
+            print("Editor : La sauvegarde a échoué, le journal est conservé : " + str(e))
+            return
+        self.journal.discard()
 
     def on_exit(self):
-        pygame.quit()
+        self.check_save(wait=True)
+        self.journal.autosave()
+        super().on_exit()
 
 class MenuItem:
     def __init__(self, value, image, pos, size, txt=None):
-        self.font = pygame.font.Font(None, 32)
-
         self.value = value
-        self.image = image.copy()
-        if txt:
-            self.txt = self.font.render(txt, True, (200,200,200))
-            self.image.blit(self.txt, (0,0))
+        self.image = image
+        self.txt = ASSETS.text(txt, 32, (200,200,200)) if txt else None
         self.pos = pos
         self.size = size
         self.selected = False
 
     def on_render(self, dst):
         dst.blit(self.image, self.pos)
+        if self.txt:
+            dst.blit(self.txt, self.pos, (0, 0) + tuple(self.size))
         if self.selected:
             x,y = self.pos
             w,h = self.size
@@ -113,51 +253,90 @@ class Menu:
 
         self.items = []
 
+    def visible(self):
+        """Indices of the items shown."""
+        return range(len(self.items))
+
+    def select(self, n):
+        self.items[self.current].selected = False
+        self.current = n
+        self.items[self.current].selected = True
+
     def on_render(self, dst):
         x,y = self.pos
         w,h = self.size
         pygame.draw.rect(dst, (0,0,0), (x,y,w,h))
-        for b in self.items:
-            b.on_render(dst)
+        for n in self.visible():
+            self.items[n].on_render(dst)
 
     def test_click(self, pos):
         click_on_me = test_in_rect((self.pos[0], self.pos[1], self.size[0], self.size[1]), pos)
-        for n,b in enumerate(self.items):
-            x,y = b.pos
-            w,h = b.size
+        for n in self.visible():
+            x,y = self.items[n].pos
+            w,h = self.items[n].size
             if test_in_rect((x,y,w,h), pos):
-                self.items[self.current].selected = False
-                self.current = n
-                self.items[self.current].selected = True
+                self.select(n)
         return click_on_me
     def test_key(self, k):
         return False
+    def scroll(self, pages):
+        pass
 
     def get_current(self):
         return self.items[self.current].value
 
 class SideMenu(Menu):
-    def __init__(self, pos, size):
+
+    """The block types in a column, by pages of the items fitting in its
+    height, the page shown being the one of the current item."""
+
+    def __init__(self, pos, size, sprites):
+        """args :
+            - sprites : dict of block type name to sprite
+        """
         super().__init__(pos, size)
         x,y = pos
         x,y = x + 10, y + 10
-        k = list(Block.SPRITES.keys())
+        # The bottom of the menu shows the page number.
+        self.per_page = max(1, (size[1] - 40) // (Block.BLOCK_SIZE + 5))
+        k = list(sprites.keys())
         k.sort()
-        for b in k:
-            i = MenuItem(b, Block.SPRITES[b], (x,y), (Block.BLOCK_SIZE, Block.BLOCK_SIZE), b)
+        for n,b in enumerate(k):
+            i = MenuItem(b, sprites[b], (x, y + (n % self.per_page) * (Block.BLOCK_SIZE + 5)), (Block.BLOCK_SIZE, Block.BLOCK_SIZE), b)
             self.items.append(i)
-            y += Block.BLOCK_SIZE + 5
         self.items[0].selected = True
+
+    def pages(self):
+        return (len(self.items) - 1) // self.per_page + 1
+
+    def visible(self):
+        start = self.current // self.per_page * self.per_page
+        return range(start, min(start + self.per_page, len(self.items)))
+
+    def on_render(self, dst):
+        super().on_render(dst)
+        if self.pages() > 1:
+            txt = ASSETS.text("{}/{}".format(self.current // self.per_page + 1, self.pages()), 20, (200,200,200))
+            dst.blit(txt, (self.pos[0] + 5, self.pos[1] + self.size[1] - txt.get_height() - 5))
+
+    def scroll(self, pages):
+        """Show another page, selecting the item at the same place in it."""
+        self.select(min(max(self.current + pages * self.per_page, 0), len(self.items) - 1))
+
     def test_key(self, k):
         if k==K_UP:
             c = (self.current - 1) % len(self.items)
         elif k == K_DOWN:
             c = (self.current + 1) % len(self.items)
+        elif k == K_PAGEUP:
+            self.scroll(-1)
+            return True
+        elif k == K_PAGEDOWN:
+            self.scroll(1)
+            return True
         else :
             return False
-        self.items[self.current].selected = False
-        self.current = c
-        self.items[self.current].selected = True
+        self.select(c)
         return True
 
 class BottomMenu(Menu):
@@ -0,0 +1,191 @@
+from array import array
+
+import pygame
+from pygame.locals import *
+
+from sprites import FrameTable, ANIMATIONS
+from character import Character
+
+def description_errors(description):
+    """Problems of a character definition which keep it from being loaded,
+    as messages (empty if there is none)."""
+    if not isinstance(description, dict):
+        return ["not a JSON object"]
+    errors = []
+    if not isinstance(description.get('Sprite sheet'), str):
+        errors.append("no Sprite sheet")
+    animations = description.get('Animations')
+    if not isinstance(animations, dict):
+        return errors + ["no Animations"]
+    for direction in ("Left", "Right"):
+        a = animations.get(direction)
+        if not isinstance(a, dict):
+            errors.append("no {} animation".format(direction))
+            continue
+        for field in ('x', 'y', 'width', 'height'):
+            if not isinstance(a.get(field), int):
+                errors.append("{} animation without {}".format(direction, field))
+        for field in ('Frames', 'Delay'):
+            if not isinstance(a.get(field, 1), int) or a.get(field, 1) < 1:
+                errors.append("{} animation with a wrong {}".format(direction, field))
+    if not isinstance(description.get('Physics', {}), dict):
+        errors.append("Physics is not an object")
+    return errors
+
+class CharacterType:
+
+    """A kind of character, as described by a character definition file.
+
+        {
+            "Sprite sheet" : "Characters/Monster_A/Monster_A.png",
+            "Animations" : {
+                "Left" : {"x":0, "y":0, "width":32, "height":32, "Frames":2, "Delay":4},
+                "Right" : {"x":0, "y":32, "width":32, "height":32, "Frames":2, "Delay":4}
+            },
+            "Physics" : {"X_DISPLACEMENT":4, "Y_DISPLACEMENT":5, "Y_SPEED_MAX":30}
+        }
+
+    Frames are laid out horizontally from (x, y), Delay is the number of
+    simulation ticks a frame lasts. Missing physics constants are the ones
+    of Character. anims are the animation ids of each direction.
+    """
+
+    def __init__(self, name, sprite_sheet, description):
+        self.name = name
+        self.anims = []
+        for direction in ("Left", "Right"):
+            a = description['Animations'][direction]
+            x, y, w, h = a['x'], a['y'], a['width'], a['height']
+            nb, delay = a.get('Frames', 1), a.get('Delay', 1)
+            images = [sprite_sheet.image_at((x + i * w, y, w, h)) for i in range(nb)]
+            self.anims.append(ANIMATIONS.add((sprite_sheet.key, (x, y, w, h), nb, delay), FrameTable(images, delay)))
+        self.width, self.height = ANIMATIONS.tables[self.anims[0]].size
+        physics = description.get('Physics', {})
+        self.x_displacement = physics.get('X_DISPLACEMENT', Character.X_DISPLACEMENT)
+        self.y_displacement = physics.get('Y_DISPLACEMENT', Character.Y_DISPLACEMENT)
+        # Falling speed, Y_SPEED_MAX being given as a (negative) jump speed in Character.
+        self.y_speed_max = abs(physics.get('Y_SPEED_MAX', Character.Y_SPEED_MAX))
+
+class EntityBatch:
+
+    """The non player characters of a level, in struct-of-arrays form.
+
+    Each character is an index in parallel arrays (type, position, vertical
+    speed, direction, patrol bounds, animation id and start tick), updated
+    together by update() instead of one method call per character. They
+    walk between their patrol bounds, turn back at walls, and fall when
+    there is no solid tile under them.
+    """
+
+    LEFT = Character.LEFT
+    RIGHT = Character.RIGHT
+
+    def __init__(self):
+        self.types = []
+        self.type_ids = {}
+        self.kind = array('H')
+        self.x = array('l')
+        self.y = array('l')
+        self.v_y = array('l')
+        self.direction = array('b')
+        self.x_min = array('l')
+        self.x_max = array('l')
+        self.anim = array('H')
+        self.start = array('l')
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.kind)
+
+    def add_type(self, character_type):
+        if character_type.name in self.type_ids:
+            self.types[self.type_ids[character_type.name]] = character_type
+            return
+        self.type_ids[character_type.name] = len(self.types)
+        self.types.append(character_type)
+
+    def add(self, name, pos, left_displacement=0, right_displacement=0):
+        t = self.type_ids[name]
+        self.kind.append(t)
+        self.x.append(pos[0])
+        self.y.append(pos[1])
+        self.v_y.append(0)
+        self.direction.append(self.RIGHT)
+        self.x_min.append(pos[0] - left_displacement)
+        self.x_max.append(pos[0] + right_displacement)
+        self.anim.append(self.types[t].anims[self.RIGHT])
+        self.start.append(self.tick)
+
+    def copy(self):
+        """Independent batch of the same characters, sharing the types."""
+        batch = EntityBatch()
+        batch.types = self.types
+        batch.type_ids = self.type_ids
+        for name in ("kind", "x", "y", "v_y", "direction", "x_min", "x_max", "anim", "start"):
+            setattr(batch, name, array(getattr(self, name).typecode, getattr(self, name)))
+        batch.tick = self.tick
+        return batch
+
+    def clear(self):
+        for a in (self.kind, self.x, self.y, self.v_y, self.direction, self.x_min, self.x_max, self.anim, self.start):
+            del a[:]
+
+    def update(self, tiles):
+        """One simulation step of all the characters, against the solid
+        tiles of a TileQuery."""
+        tiles.update()
+        sweep = tiles.sweep_axis
+        types = self.types
+        kind, xs, ys, v_ys, directions = self.kind, self.x, self.y, self.v_y, self.direction
+        x_min, x_max = self.x_min, self.x_max
+        anim, start, tick = self.anim, self.start, self.tick
+        for i in range(len(kind)):
+            t = types[kind[i]]
+            x, y, w, h = xs[i], ys[i], t.width, t.height
+
+            # Gravity, landing on the top of the tiles under the feet.
+            v_y = min(v_ys[i] + t.y_displacement, t.y_speed_max)
+            dy, tile = sweep(x, y, w, h, v_y, False)
+            y += dy
+            ys[i], v_ys[i] = y, (0 if tile else v_y)
+
+            # Patrol, turning back at the bounds and at walls.
+            d = directions[i]
+            dx = t.x_displacement if d == self.RIGHT else -t.x_displacement
+            if not x_min[i] <= x + dx <= x_max[i] or sweep(x, y, w, h, dx, True)[1]:
+                d = directions[i] = self.LEFT if d == self.RIGHT else self.RIGHT
+                anim[i] = t.anims[d]
+                start[i] = tick
+            else:
+                xs[i] = x + dx
+        self.tick += 1
+
+    def rects(self):
+        types, kind = self.types, self.kind
+        return [pygame.Rect(self.x[i], self.y[i], types[kind[i]].width, types[kind[i]].height)
+                for i in range(len(kind))]
+
+    def touching(self, rect):
+        """Indices of the characters overlapping rect."""
+        return pygame.Rect(rect).collidelistall(self.rects())
+
+    def frames(self, camera):
+        """(index, image, screen rect) of the characters in view, their
+        frames being computed at once from the current tick."""
+        view = camera.rect
+        types, kind, xs, ys = self.types, self.kind, self.x, self.y
+        visible = []
+        for i in range(len(kind)):
+            t = types[kind[i]]
+            x, y = xs[i], ys[i]
+            if x + t.width > view.x and x < view.right and y + t.height > view.y and y < view.bottom:
+                visible.append(i)
+        anims = [self.anim[i] for i in visible]
+        indices = ANIMATIONS.frames(anims, [self.start[i] for i in visible], self.tick)
+        tables = ANIMATIONS.tables
+        return [(i, tables[a].images[f], pygame.Rect(camera.apply((xs[i], ys[i])), tables[a].size))
+                for i, a, f in zip(visible, anims, indices)]
+
+    def on_render(self, dst, camera):
+        for i, image, r in self.frames(camera):
+            dst.blit(image, r)
@@ -0,0 +1,83 @@
+#! /usr/bin/python3
+
+"""Runs the game logic without any window, replaying a recorded input script.
+
+An input script is a JSON list of {"tick": n, "press": [...], "release": [...]}
+entries, sorted by tick, the actions being "left", "right", "jump" and "dead".
+Pressed actions stay held until released; "jump" and "dead" act when pressed.
+"""
+
+import sys
+import json
+import time
+import argparse
+
+from app import App
+import controls
+
+class InputScript:
+
+    """Replays the actions of an input script, tick after tick, as the
+    bitsets of controls."""
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self.next = 0
+        self.held = 0
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def snapshot(self, tick):
+        """(held, pressed) bitsets of tick."""
+        pressed = 0
+        while self.next < len(self.entries) and self.entries[self.next]['tick'] <= tick:
+            e = self.entries[self.next]
+            press = controls.bits_of(e.get('press', ()))
+            pressed |= press
+            self.held = (self.held | press) & ~controls.bits_of(e.get('release', ()))
+            self.next += 1
+        return self.held, pressed
+
+    def apply(self, tick, player):
+        controls.apply(player, *self.snapshot(tick))
+
+class HeadlessRunner:
+
+    """Simulates a level as fast as possible, without rendering."""
+
+    def __init__(self, level, script=None):
+        self.app = App(level, headless=True)
+        self.script = script or InputScript()
+
+    def run(self, ticks):
+        """Run ticks simulation steps, returns a report."""
+        app = self.app
+        start = time.perf_counter()
+        for tick in range(ticks):
+            self.script.apply(tick, app.player)
+            app.on_update()
+        duration = time.perf_counter() - start
+        return {
+            "ticks": ticks,
+            "duration": duration,
+            "ticks_per_second": ticks / duration if duration else None,
+            "player": [app.player.rect.x, app.player.rect.y],
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a level without window and report the simulation speed.")
+    parser.add_argument("level")
+    parser.add_argument("-s", "--script", help="input script to replay")
+    parser.add_argument("-t", "--ticks", type=int, default=10000)
+    parser.add_argument("-n", "--sessions", type=int, default=1, help="number of sessions to run")
+    args = parser.parse_args()
+
+    reports = []
+    for _ in range(args.sessions):
+        script = InputScript.load(args.script) if args.script else None
+        reports.append(HeadlessRunner(args.level, script).run(args.ticks))
+    json.dump(reports, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,178 @@
+import os
+import json
+import base64
+from array import array
+
+from block import Block, blocks_between
+import levelformat
+
+class Edit:
+
+    """A change of the block type at a position of a layer (None is empty)."""
+
+    __slots__ = ("layer", "pos", "old", "new")
+
+    def __init__(self, layer, pos, old, new):
+        self.layer = layer
+        self.pos = pos
+        self.old = old
+        self.new = new
+
+    def apply(self, layers):
+        layers[self.layer].set_type(self.pos, self.new)
+
+    def inverse(self):
+        return Edit(self.layer, self.pos, self.new, self.old)
+
+    def as_list(self):
+        return [self.layer, self.pos[0], self.pos[1], self.old, self.new]
+
+def encode_grid(grid, palette):
+    return base64.b64encode(levelformat.encode({"": grid}, palette)).decode()
+
+def decode_grid(data):
+    palette, grids = levelformat.decode(base64.b64decode(data))
+    return grids[""], palette
+
+class GridEdit:
+
+    """A change of a whole rect of a layer, old and new being (Grid,
+    palette) of the same rect."""
+
+    __slots__ = ("layer", "old", "new")
+
+    def __init__(self, layer, old, new):
+        self.layer = layer
+        self.old = old
+        self.new = new
+
+    def apply(self, layers):
+        layers[self.layer].write_grid(*self.new)
+
+    def inverse(self):
+        return GridEdit(self.layer, self.new, self.old)
+
+    def as_list(self):
+        return ["grid", self.layer, encode_grid(*self.old), encode_grid(*self.new)]
+
+class EditJournal:
+
+    """History of the edits of the layers, for undo/redo and autosave.
+
+    Edits are grouped in batches, a batch being undone or redone at once.
+    Every applied batch (undo and redo included) is also kept until the next
+    autosave, which appends it to the journal file as JSON lines. The file is
+    replayed on the next start if the level was not saved in between.
+    """
+
+    def __init__(self, layers, path):
+        """args :
+            - layers : dict of layer name to Layer
+            - path : path of the journal file
+        """
+        self.layers = layers
+        self.path = path
+        self.undo_stack = []
+        self.redo_stack = []
+        self.unsaved = []
+
+    def apply(self, edits, history=True):
+        """Apply a batch of edits."""
+        for e in edits:
+            e.apply(self.layers)
+        self.unsaved.extend(edits)
+        if history and edits:
+            self.undo_stack.append(edits)
+            self.redo_stack.clear()
+
+    def paint(self, layer, positions, name):
+        """Set the type of the blocks at positions to name, as one batch."""
+        l = self.layers[layer]
+        edits = []
+        for p in positions:
+            old = l.type_at(p)
+            if old != name:
+                edits.append(Edit(layer, p, old, name))
+        self.apply(edits)
+
+    def rect(self, layer, start, end, name):
+        """Fill the rect of blocks between positions start and end."""
+        x, y, w, h = blocks_between(start, end)
+        ids = array('H', [1 if name else 0]) * (w * h)
+        self.paste([(layer, levelformat.Grid(x, y, w, h, ids), [name] if name else [])])
+
+    def paste(self, grids):
+        """Replace the rects of blocks of layers by the ones of grids, a
+        list of (layer, Grid, palette), as one batch."""
+        edits = []
+        for layer, grid, palette in grids:
+            old = self.layers[layer].read_grid(grid.x, grid.y, grid.width, grid.height)
+            edits.append(GridEdit(layer, old, (grid, palette)))
+        self.apply(edits)
+
+    def flood_fill(self, layer, start, name, bounds):
+        """Fill the region of blocks of the same type as the one at start,
+        without going out of the bounds rect."""
+        l = self.layers[layer]
+        s = Block.BLOCK_SIZE
+        target = l.type_at(start)
+        if target == name:
+            return
+        seen = {start}
+        todo = [start]
+        while todo:
+            x, y = todo.pop()
+            for p in ((x - s, y), (x + s, y), (x, y - s), (x, y + s)):
+                if p not in seen and bounds.collidepoint(p) and l.type_at(p) == target:
+                    seen.add(p)
+                    todo.append(p)
+        self.paint(layer, seen, name)
+
+    def undo(self):
+        if self.undo_stack:
+            edits = self.undo_stack.pop()
+            self.apply([e.inverse() for e in reversed(edits)], history=False)
+            self.redo_stack.append(edits)
+
+    def redo(self):
+        if self.redo_stack:
+            edits = self.redo_stack.pop()
+            self.apply(edits, history=False)
+            self.undo_stack.append(edits)
+
+    def autosave(self):
+        """Append the edits applied since the last autosave to the journal file."""
+        if not self.unsaved:
+            return
+        with open(self.path, 'a') as f:
+            for e in self.unsaved:
+                f.write(json.dumps(e.as_list()) + "\n")
+        self.unsaved.clear()
+
+    def replay(self):
+        """Apply the edits of the journal file, if any."""
+        if not os.path.exists(self.path):
+            return
+        edits = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if entry[0] == "grid":
+                        edits.append(GridEdit(entry[1], decode_grid(entry[2]), decode_grid(entry[3])))
+                        continue
+                except (ValueError, IndexError):
+                    # Last line cut by a crash.
+                    break
+                l, x, y, old, new = entry
+                edits.append(Edit(l, (x, y), old, new))
+        print("EditJournal : Reprise de {} modifications.".format(len(edits)))
+        self.apply(edits, history=False)
+        self.unsaved.clear()
+
+    def discard(self):
+        """Forget the journal file, once the level is saved. It must have
+        been autosaved before the blocks were copied for the save : the edits
+        applied since then are kept for the next autosave."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,218 @@
+from array import array
+
+import pygame
+from pygame.locals import *
+
+from block import Block, BlockTypes
+from tilemap import TileMap
+from levelformat import Grid
+
+class Layer:
+
+    """A layer of blocks, keyed by position and stored by chunks.
+
+    It behaves like a dict of blocks, but only the tile ids are stored, in a
+    TileMap. Block sprites are created on demand and kept for the chunks
+    near the view; stream() releases the ones of the chunks far from it.
+    Each chunk is rendered once into an off-screen surface, which is only
+    baked again when one of its tiles changes and it comes into view.
+    revision is incremented on every change of the layer, and versions
+    gives the last revision in which each chunk changed. The block types
+    are the ones of types, usually shared by the layers of an app.
+    """
+
+    CHUNK_SIZE = TileMap.CHUNK_SIZE
+    STREAM_MARGIN = 1
+
+    def __init__(self, types=None):
+        self.types = types if types is not None else BlockTypes()
+        self.tiles = TileMap()
+        self.blocks = {}
+        self.surfaces = {}
+        self.dirty = set()
+        self.modified = False
+        self.revision = 0
+        self.versions = {}
+
+    @staticmethod
+    def chunk_of(pos):
+        size = Layer.CHUNK_SIZE * Block.BLOCK_SIZE
+        return (pos[0] // size, pos[1] // size)
+
+    @staticmethod
+    def chunks_in(rect):
+        """Chunks overlapping the given (x, y, w, h) rect."""
+        size = Layer.CHUNK_SIZE * Block.BLOCK_SIZE
+        x, y, w, h = rect
+        for cx in range(x // size, (x + w - 1) // size + 1):
+            for cy in range(y // size, (y + h - 1) // size + 1):
+                yield (cx, cy)
+
+    def touch(self, chunks):
+        """Mark chunks as changed, in a new revision."""
+        self.revision += 1
+        for c in chunks:
+            self.dirty.add(c)
+            self.versions[c] = self.revision
+
+    def block(self, pos, t):
+        """The Block of tile id t at pos, created if needed."""
+        blocks = self.blocks.setdefault(self.chunk_of(pos), {})
+        b = blocks.get(pos)
+        if b is None:
+            b = blocks[pos] = Block(pos, self.tiles.name_of(t), self.types)
+        return b
+
+    def load(self, blocks):
+        """Add blocks given as {"x", "y", "Type"} dicts, without creating them."""
+        chunks = set()
+        for b in blocks:
+            pos = (b['x'], b['y'])
+            c = self.chunk_of(pos)
+            self.tiles.set(pos, self.tiles.id_of(b['Type']))
+            self.blocks.get(c, {}).pop(pos, None)
+            chunks.add(c)
+        self.touch(chunks)
+
+    def load_grid(self, grid, palette):
+        """Add the blocks of a levelformat.Grid, without creating them."""
+        self.tiles.set_grid(grid, palette)
+        self.blocks.clear()
+        self.touch(self.tiles.chunks)
+
+    def stream(self, rect):
+        """Release the blocks and surfaces of the chunks far from rect."""
+        size = self.CHUNK_SIZE * Block.BLOCK_SIZE
+        margin = 2 * (self.STREAM_MARGIN + 1) * size
+        area = pygame.Rect(rect).inflate(margin, margin)
+        far = lambda c: not area.colliderect((c[0] * size, c[1] * size, size, size))
+        for c in [c for c in self.blocks if far(c)]:
+            del self.blocks[c]
+        for c in [c for c in self.surfaces if far(c)]:
+            del self.surfaces[c]
+            self.dirty.add(c)
+
+    def type_at(self, pos):
+        """Block type name at pos, None if empty."""
+        return self.tiles.name_of(self.tiles.get(pos))
+
+    def set_type(self, pos, name):
+        """Put a block of type name at pos (remove it if name is None),
+        without creating the Block."""
+        self.tiles.set(pos, self.tiles.id_of(name) if name else 0)
+        c = self.chunk_of(pos)
+        self.blocks.get(c, {}).pop(pos, None)
+        self.modified = True
+        self.touch((c,))
+
+    def read_grid(self, x, y, width, height):
+        """(Grid of the rect of width x height blocks from block (x, y),
+        palette its ids refer to)."""
+        return self.tiles.read_grid(x, y, width, height), list(self.tiles.palette)
+
+    def write_grid(self, grid, palette):
+        """Replace the blocks of the rect of a Grid, whose ids refer to
+        palette, by its ones (empty ones included), without creating them."""
+        mapping = [0] + [self.tiles.id_of(name) for name in palette]
+        if mapping != list(range(len(mapping))):
+            grid = Grid(grid.x, grid.y, grid.width, grid.height, array('H', map(mapping.__getitem__, grid.ids)))
+        changed = self.tiles.write_grid(grid)
+        if changed:
+            for c in changed:
+                self.blocks.pop(c, None)
+            self.modified = True
+            self.touch(changed)
+
+    def __getitem__(self, pos):
+        t = self.tiles.get(pos)
+        if not t:
+            raise KeyError(pos)
+        return self.block(pos, t)
+
+    def __setitem__(self, pos, block):
+        self.tiles.set(pos, self.tiles.id_of(block.image_name))
+        c = self.chunk_of(pos)
+        self.blocks.setdefault(c, {})[pos] = block
+        self.modified = True
+        self.touch((c,))
+
+    def __delitem__(self, pos):
+        if not self.tiles.set(pos, 0):
+            raise KeyError(pos)
+        c = self.chunk_of(pos)
+        self.blocks.get(c, {}).pop(pos, None)
+        self.modified = True
+        self.touch((c,))
+
+    def __contains__(self, pos):
+        return bool(self.tiles.get(pos))
+
+    def __len__(self):
+        return self.tiles.count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, pos, default=None):
+        t = self.tiles.get(pos)
+        if not t:
+            return default
+        return self.block(pos, t)
+
+    def pop(self, pos, *default):
+        if pos in self:
+            b = self[pos]
+            del self[pos]
+            return b
+        if default:
+            return default[0]
+        raise KeyError(pos)
+
+    def keys(self):
+        return [p for p, t in self.tiles.positions()]
+
+    def values(self):
+        return [self.block(p, t) for p, t in self.tiles.positions()]
+
+    def items(self):
+        return [(p, self.block(p, t)) for p, t in self.tiles.positions()]
+
+    def as_list(self):
+        """The blocks as {"x", "y", "Type"} dicts, without creating them."""
+        name = self.tiles.name_of
+        return [{"x":p[0], "y":p[1], "Type":name(t)} for p, t in self.tiles.positions()]
+
+    def clear(self):
+        self.tiles.clear()
+        self.blocks.clear()
+        self.surfaces.clear()
+        self.dirty.clear()
+        self.versions.clear()
+        self.revision += 1
+
+    def blocks_in(self, rect):
+        """Blocks of the chunks overlapping the given rect."""
+        for c in self.chunks_in(rect):
+            for p, t in self.tiles.chunk_positions(c):
+                yield self.block(p, t)
+
+    def bake(self, c):
+        if c not in self.tiles.chunks:
+            self.surfaces.pop(c, None)
+            return
+        size = self.CHUNK_SIZE * Block.BLOCK_SIZE
+        x, y = c[0] * size, c[1] * size
+        surface = pygame.Surface((size, size), SRCALPHA)
+        for p, t in self.tiles.chunk_positions(c):
+            surface.blit(self.types.sprites[self.tiles.name_of(t)], (p[0] - x, p[1] - y))
+        self.surfaces[c] = surface
+
+    def on_render(self, dst, camera):
+        size = self.CHUNK_SIZE * Block.BLOCK_SIZE
+        for c in self.chunks_in(camera.rect):
+            if c in self.dirty:
+                self.dirty.discard(c)
+                self.bake(c)
+            s = self.surfaces.get(c)
+            if s:
+                dst.blit(s, camera.apply((c[0] * size, c[1] * size)))
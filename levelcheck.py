@@ -0,0 +1,178 @@
+#! /usr/bin/python3
+
+"""Validates, normalizes and repacks level archives, in parallel.
+
+Every level is read with the loader of the game (without display) by a pool
+of processes, and checked :
+    - every block Type is in the "Sprites description" of the sheet,
+    - block positions are aligned on the grid and unique in their layer,
+    - sprite rects (of the blocks and of the characters) lie inside their
+      sheet,
+    - placed characters are declared and described.
+Duplicated blocks only give a warning, as the normalization drops them. A
+level without error can be normalized (blocks sorted and deduplicated, layers
+converted to the requested format) and repacked, each member being compressed
+at the best level unless that does not make it smaller.
+
+The report is a JSON list, one entry per level.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from block import get_equivalent_block_pos
+from bubbleLoader import LevelData, BubbleLoaderError, rewrite_archive
+import levelformat
+
+COMPRESSION_LEVEL = 9
+
+def rect_in(rect, size):
+    x, y, w, h = rect
+    return x >= 0 and y >= 0 and w > 0 and h > 0 and x + w <= size[0] and y + h <= size[1]
+
+def layers_of(data):
+    """{"x", "y", "Type"} dicts of each layer of a LevelData."""
+    if data.grids is not None:
+        return {name: grid.as_blocks(data.palette) for name, grid in data.grids.items()}
+    blocks_info = data.manifest['Blocks']
+    return {name: blocks_info.get(name, []) for name in levelformat.LAYER_NAMES}
+
+def normalized(blocks):
+    """blocks sorted by position, the last one of a position being kept as
+    by Layer.load."""
+    unique = {(b['x'], b['y']): b['Type'] for b in blocks}
+    return [{"x":p[0], "y":p[1], "Type":t} for p, t in sorted(unique.items(), key=lambda i: (i[0][1], i[0][0]))]
+
+def validate(data):
+    """(errors, warnings) of a LevelData, as lists of messages."""
+    errors, warnings = [], []
+    blocks_info = data.manifest.get('Blocks')
+    if not blocks_info:
+        errors.append("no Blocks section")
+        return errors, warnings
+
+    sheet = blocks_info['Sprite sheet']
+    size = data.sheets[sheet['Path']].get_size()
+    names = set()
+    for d in sheet['Sprites description']:
+        if d['Name'] in names:
+            errors.append("sprite {} described twice".format(d['Name']))
+        names.add(d['Name'])
+        if not rect_in((d['x'], d['y'], d['width'], d['height']), size):
+            errors.append("sprite {} out of the sheet {}".format(d['Name'], sheet['Path']))
+
+    for name, blocks in layers_of(data).items():
+        seen = set()
+        for b in blocks:
+            pos = (b['x'], b['y'])
+            if b['Type'] not in names:
+                errors.append("{} : unknown block type {} at {}".format(name, b['Type'], pos))
+            if get_equivalent_block_pos(pos) != pos:
+                errors.append("{} : block at {} not aligned on the grid".format(name, pos))
+            if pos in seen:
+                warnings.append("{} : several blocks at {}".format(name, pos))
+            seen.add(pos)
+
+    characters_info = data.manifest.get('Characters', {})
+    for name, messages in data.character_errors.items():
+        for m in messages:
+            errors.append("character {} : {}".format(name, m))
+    for name, description in data.characters.items():
+        if description is None:
+            warnings.append("character {} is not described".format(name))
+            continue
+        size = data.sheets[description['Sprite sheet']].get_size()
+        for direction in ("Left", "Right"):
+            a = description['Animations'][direction]
+            for i in range(a.get('Frames', 1)):
+                if not rect_in((a['x'] + i * a['width'], a['y'], a['width'], a['height']), size):
+                    errors.append("character {} : {} frame {} out of its sheet".format(name, direction, i))
+    for p in characters_info.get('Places', []):
+        if not isinstance(p, dict) or not isinstance(p.get('Name'), str) or \
+                not all(isinstance(p.get(k), int) for k in ('x', 'y')):
+            errors.append("character place without Name, x or y : {}".format(p))
+        elif p['Name'] not in data.characters and p['Name'] not in data.character_errors:
+            errors.append("placed character {} is not declared".format(p['Name']))
+    return errors, warnings
+
+def repack(data, binary=None):
+    """Normalize the blocks of a LevelData and write its archive again,
+    with the layers in binary (or JSON) form if binary is given, else in
+    their current form."""
+    manifest = data.manifest
+    blocks_info = manifest['Blocks']
+    layers = {name: normalized(blocks) for name, blocks in layers_of(data).items()}
+    path = blocks_info.get('Layers file')
+    if binary is None:
+        binary = path is not None
+    removed = ()
+    for name in levelformat.LAYER_NAMES:
+        blocks_info.pop(name, None)
+    if binary:
+        blocks_info['Layers file'] = path = path or levelformat.LAYERS_PATH
+        members = {path: levelformat.to_binary(dict(blocks_info, **layers))}
+    else:
+        blocks_info.update(layers)
+        if path:
+            del blocks_info['Layers file']
+            removed = (path,)
+        members = {}
+    members["manifest.json"] = json.dumps(manifest, separators=(",", ":")).encode()
+    rewrite_archive(data.file, members, removed, COMPRESSION_LEVEL)
+
+def check(filepath, fix=False, binary=None):
+    """Report of a level, repacked if fix and it has no error."""
+    start = time.perf_counter()
+    report = {"level": filepath, "errors": [], "warnings": [], "repacked": False,
+              "size": os.path.getsize(filepath)}
+    try:
+        data = LevelData(filepath).read()
+        report["errors"], report["warnings"] = validate(data)
+    except (OSError, ValueError, KeyError, BubbleLoaderError, levelformat.LevelFormatError) as e:
+        report["errors"].append("unreadable : {!r}".format(e))
+    if fix and not report["errors"]:
+        repack(data, binary)
+        report["repacked"] = True
+        report["new_size"] = os.path.getsize(filepath)
+    report["duration"] = time.perf_counter() - start
+    return report
+
+def levels_in(paths):
+    """Level archives of paths, directories being searched recursively."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for f in sorted(files):
+                    if f.endswith(".zip"):
+                        yield os.path.join(root, f)
+        else:
+            yield path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate, normalize and repack level archives.")
+    parser.add_argument("levels", nargs="+", help="level archives, or directories containing them")
+    parser.add_argument("-f", "--fix", action="store_true", help="normalize and repack the valid levels")
+    parser.add_argument("--format", choices=("binary", "json"), help="format of the layers of repacked levels")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes")
+    parser.add_argument("-o", "--output", help="write the report to this file")
+    args = parser.parse_args()
+
+    levels = list(levels_in(args.levels))
+    binary = None if args.format is None else args.format == "binary"
+    with ProcessPoolExecutor(args.jobs) as pool:
+        reports = list(pool.map(check, levels, [args.fix] * len(levels), [binary] * len(levels),
+                                chunksize=max(1, len(levels) // (4 * (args.jobs or os.cpu_count() or 1)))))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+    else:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    invalid = sum(1 for r in reports if r["errors"])
+    print("levelcheck : {} niveaux, {} invalides.".format(len(reports), invalid), file=sys.stderr)
+    sys.exit(1 if invalid else 0)
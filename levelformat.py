@@ -0,0 +1,159 @@
+#! /usr/bin/python3
+
+"""Compact binary encoding of the block layers of a level.
+
+The layers are stored in the archive member named by the "Layers file" key of
+the manifest "Blocks" section, instead of the JSON block lists. Layout, little
+endian :
+    - b"BBL1"
+    - uint16 palette size, then for each entry an uint8 length and the utf-8
+      name of a block type. Tile id i stands for palette[i-1], 0 is empty.
+    - uint8 layer count, then for each layer an uint8 length and the utf-8
+      name of the layer ("Background blocks", ...), the int32 position of the
+      grid origin and its uint32 width and height (in blocks), and the
+      width*height uint16 tile ids, row after row.
+"""
+
+import sys
+import json
+import struct
+import zipfile
+import argparse
+from array import array
+
+from block import Block
+
+MAGIC = b"BBL1"
+LAYERS_PATH = "Blocks/layers.bin"
+LAYER_NAMES = ("Background blocks", "Middleground blocks", "Foreground blocks")
+
+class LevelFormatError(Exception):
+    pass
+
+class Grid:
+
+    """A rectangular grid of tile ids, positioned in blocks."""
+
+    def __init__(self, x, y, width, height, ids=None):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.ids = ids if ids is not None else array('H', bytes(2 * width * height))
+
+    def positions(self):
+        """(position in pixels, tile id) of the non empty tiles."""
+        s = Block.BLOCK_SIZE
+        w = self.width
+        for i, t in enumerate(self.ids):
+            if t:
+                yield ((self.x + i % w) * s, (self.y + i // w) * s), t
+
+    @classmethod
+    def from_blocks(cls, blocks, palette):
+        """Grid from {"x", "y", "Type"} dicts, palette maps names to ids."""
+        s = Block.BLOCK_SIZE
+        if not blocks:
+            return cls(0, 0, 0, 0)
+        xs = [b['x'] // s for b in blocks]
+        ys = [b['y'] // s for b in blocks]
+        x, y = min(xs), min(ys)
+        grid = cls(x, y, max(xs) - x + 1, max(ys) - y + 1)
+        for b, bx, by in zip(blocks, xs, ys):
+            grid.ids[(by - y) * grid.width + bx - x] = palette[b['Type']]
+        return grid
+
+    def as_blocks(self, palette):
+        """{"x", "y", "Type"} dicts, palette is the list of type names."""
+        return [{"x":p[0], "y":p[1], "Type":palette[t - 1]} for p, t in self.positions()]
+
+def encode(layers, palette):
+    """Binary form of layers, a dict of layer name to Grid."""
+    out = [MAGIC, struct.pack("<H", len(palette))]
+    for name in palette:
+        n = name.encode()
+        out.append(struct.pack("<B", len(n)) + n)
+    out.append(struct.pack("<B", len(layers)))
+    for name, grid in layers.items():
+        n = name.encode()
+        out.append(struct.pack("<B", len(n)) + n)
+        out.append(struct.pack("<iiII", grid.x, grid.y, grid.width, grid.height))
+        ids = array('H', grid.ids)
+        if sys.byteorder == "big":
+            ids.byteswap()
+        out.append(ids.tobytes())
+    return b"".join(out)
+
+def decode(data):
+    """(palette, dict of layer name to Grid) from the binary form."""
+    if data[:4] != MAGIC:
+        raise LevelFormatError("levelformat : Ce n'est pas un fichier de calques.")
+    offset = 4
+    count, = struct.unpack_from("<H", data, offset)
+    offset += 2
+    palette = []
+    for _ in range(count):
+        n = data[offset]
+        palette.append(data[offset + 1:offset + 1 + n].decode())
+        offset += 1 + n
+    layers = {}
+    count = data[offset]
+    offset += 1
+    for _ in range(count):
+        n = data[offset]
+        name = data[offset + 1:offset + 1 + n].decode()
+        offset += 1 + n
+        x, y, w, h = struct.unpack_from("<iiII", data, offset)
+        offset += 16
+        ids = array('H')
+        ids.frombytes(data[offset:offset + 2 * w * h])
+        if sys.byteorder == "big":
+            ids.byteswap()
+        offset += 2 * w * h
+        layers[name] = Grid(x, y, w, h, ids)
+    return palette, layers
+
+def palette_of(blocks_info):
+    return [d['Name'] for d in blocks_info['Sprite sheet']['Sprites description']]
+
+def to_binary(blocks_info):
+    """Binary form of the JSON block lists of a manifest "Blocks" section."""
+    palette = palette_of(blocks_info)
+    ids = {name: i + 1 for i, name in enumerate(palette)}
+    layers = {name: Grid.from_blocks(blocks_info.get(name, []), ids) for name in LAYER_NAMES}
+    return encode(layers, palette)
+
+def to_json(data):
+    """JSON block lists, as in a manifest "Blocks" section, from the binary form."""
+    palette, layers = decode(data)
+    return {name: grid.as_blocks(palette) for name, grid in layers.items()}
+
+def convert(filepath, binary):
+    from bubbleLoader import rewrite_archive
+    with zipfile.ZipFile(filepath) as archive:
+        manifest = json.loads(archive.read("manifest.json").decode())
+        blocks_info = manifest['Blocks']
+        path = blocks_info.get('Layers file')
+        if binary and not path:
+            data = to_binary(blocks_info)
+            blocks_info['Layers file'] = LAYERS_PATH
+            for name in LAYER_NAMES:
+                blocks_info.pop(name, None)
+            members = {"manifest.json": json.dumps(manifest).encode(), LAYERS_PATH: data}
+            removed = ()
+        elif not binary and path:
+            blocks_info.update(to_json(archive.read(path)))
+            del blocks_info['Layers file']
+            members = {"manifest.json": json.dumps(manifest).encode()}
+            removed = (path,)
+        else:
+            return
+    rewrite_archive(filepath, members, removed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the block layers of levels between JSON and binary.")
+    parser.add_argument("format", choices=("binary", "json"))
+    parser.add_argument("levels", nargs="+")
+    args = parser.parse_args()
+    for level in args.levels:
+        convert(level, args.format == "binary")
@@ -1,8 +1,22 @@
 #! /usr/bin/python3
 
+import argparse
+
 from app import App
+from capture import FrameExporter, RawSink, PngSink, PipeSink
+
+SINKS = {"raw": RawSink, "png": PngSink, "pipe": PipeSink}
 
 if __name__ == '__main__':
-    a = App()
-    a.on_mainloop()
-    a.on_exit()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Bubble Platform !")
+    parser.add_argument("level", nargs="?", default="test.zip")
+    parser.add_argument("-r", "--record", help="write the inputs of the session to this file, to be replayed by headless.py")
+    parser.add_argument("-c", "--capture", help="export the frames to this file, directory (png) or command (pipe)")
+    parser.add_argument("--sink", choices=SINKS, default="png", help="how the frames are exported")
+    args = parser.parse_args()
+    exporter = FrameExporter(SINKS[args.sink](args.capture)) if args.capture else None
+    a = App(args.level, record=args.record, exporter=exporter)
+    try:
+        a.on_mainloop()
+    finally:
+        a.on_exit()
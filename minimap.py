@@ -0,0 +1,142 @@
+"""Overview of the block layers of a level, for the editor."""
+
+import pygame
+from pygame.locals import *
+
+from block import Block
+from tilemap import TileMap
+
+MINIMAP_SIZE = (150, 150)
+MINIMAP_COLOR = (40,40,40)
+VIEW_COLOR = (255,0,0)
+
+class Minimap:
+
+    """The layers drawn one over the other, a pixel standing for step x step
+    blocks.
+
+    Each chunk is downsampled from its tile ids, taking one tile out of step
+    along each axis, and drawn with the average color of the sprite of each
+    tile. update() only draws again the chunks changed since the previous
+    one (see Layer.versions), unless the layers grew out of the area drawn
+    or were cleared. A map too large for the minimap even at one pixel per
+    chunk is scaled down.
+    """
+
+    EMPTY = bytes(4)
+
+    def __init__(self, layers, pos, size=MINIMAP_SIZE):
+        """args :
+            - layers : the layers, from the bottom one to the top one
+            - pos, size : rect of the minimap in the window
+        """
+        self.layers = layers
+        self.rect = pygame.Rect(pos, size)
+        self.colors = {}
+        self.revisions = None
+        self.sizes = None
+        self.area = None
+        self.step = 1
+        self.surface = None
+        self.image = None
+
+    def color(self, types, name):
+        """RGBA bytes of a block type."""
+        c = self.colors.get(name)
+        if c is None:
+            sprite = types.sprites.get(name)
+            rgb = pygame.transform.average_color(sprite)[:3] if sprite else (255,0,255)
+            c = self.colors[name] = bytes(rgb) + b"\xff"
+        return c
+
+    def chunk_image(self, layer, c, table):
+        """Downsampled image of chunk c of layer, table giving the RGBA
+        bytes of each tile id. None if the chunk is empty."""
+        chunk = layer.tiles.chunks.get(c)
+        if not chunk:
+            return None
+        n, k = TileMap.CHUNK_SIZE, self.step
+        rows = [chunk[r * n:(r + 1) * n:k] for r in range(0, n, k)]
+        pixels = b"".join(table[t] for row in rows for t in row)
+        return pygame.image.frombytes(pixels, (n // k, n // k), "RGBA")
+
+    def draw(self, chunks):
+        n = TileMap.CHUNK_SIZE
+        side = n // self.step
+        tables = [[self.EMPTY] + [self.color(l.types, name) for name in l.tiles.palette] for l in self.layers]
+        for c in chunks:
+            pos = ((c[0] - self.area[0]) * side, (c[1] - self.area[1]) * side)
+            self.surface.fill((0,0,0,0), (pos, (side, side)))
+            for l, table in zip(self.layers, tables):
+                image = self.chunk_image(l, c, table)
+                if image:
+                    self.surface.blit(image, pos)
+
+    def redraw(self):
+        """Draw everything again, in an area fitting the chunks of the layers."""
+        chunks = set()
+        for l in self.layers:
+            chunks.update(l.tiles.chunks)
+        if not chunks:
+            self.area = None
+            self.surface = self.image = None
+            return
+        self.area = (min(c[0] for c in chunks), min(c[1] for c in chunks),
+                     max(c[0] for c in chunks), max(c[1] for c in chunks))
+        n = TileMap.CHUNK_SIZE
+        w, h = (self.area[2] - self.area[0] + 1) * n, (self.area[3] - self.area[1] + 1) * n
+        self.step = 1
+        while self.step < n and (w // self.step > self.rect.w or h // self.step > self.rect.h):
+            self.step *= 2
+        self.surface = pygame.Surface((w // self.step, h // self.step), SRCALPHA)
+        self.draw(chunks)
+
+    def update(self):
+        revisions = [l.revision for l in self.layers]
+        if revisions == self.revisions:
+            return
+        sizes = [len(l.versions) for l in self.layers]
+        changed = set()
+        if self.revisions is not None:
+            for l, r in zip(self.layers, self.revisions):
+                changed.update(c for c, v in l.versions.items() if v > r)
+        if self.revisions is None or self.area is None or \
+                any(s < old for s, old in zip(sizes, self.sizes)) or \
+                any(not (self.area[0] <= c[0] <= self.area[2] and self.area[1] <= c[1] <= self.area[3]) for c in changed):
+            self.redraw()
+        else:
+            self.draw(changed)
+        self.revisions = revisions
+        self.sizes = sizes
+        if self.surface is not None:
+            w, h = self.surface.get_size()
+            scale = min(1, self.rect.w / w, self.rect.h / h)
+            self.image = self.surface if scale == 1 else \
+                pygame.transform.scale(self.surface, (max(1, int(w * scale)), max(1, int(h * scale))))
+
+    def pixels_per_block(self):
+        return self.image.get_width() / (self.surface.get_width() * self.step)
+
+    def to_world(self, pos):
+        """World position shown at the window position pos, None when
+        outside of the map."""
+        if self.image is None or not self.rect.collidepoint(pos):
+            return None
+        scale = self.pixels_per_block()
+        n, s = TileMap.CHUNK_SIZE, Block.BLOCK_SIZE
+        return (int((self.area[0] * n + (pos[0] - self.rect.x) / scale) * s),
+                int((self.area[1] * n + (pos[1] - self.rect.y) / scale) * s))
+
+    def on_render(self, dst, camera):
+        pygame.draw.rect(dst, MINIMAP_COLOR, self.rect)
+        if self.image is None:
+            return
+        dst.blit(self.image, self.rect.topleft)
+        scale = self.pixels_per_block() / Block.BLOCK_SIZE
+        n, s = TileMap.CHUNK_SIZE, Block.BLOCK_SIZE
+        x = self.rect.x + (camera.rect.x - self.area[0] * n * s) * scale
+        y = self.rect.y + (camera.rect.y - self.area[1] * n * s) * scale
+        view = pygame.Rect(int(x), int(y), max(2, int(camera.rect.w * scale)), max(2, int(camera.rect.h * scale)))
+        dst.set_clip(self.rect)
+        pygame.draw.rect(dst, VIEW_COLOR, view, 1)
+        dst.set_clip(None)
@@ -0,0 +1,97 @@
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import pygame
+from pygame.locals import *
+
+from assets import ASSETS
+
+class Profiler:
+
+    """Timers for the phases of the main loop and of the loader.
+
+    Each phase keeps its last WINDOW durations, for rolling percentiles.
+    Hooks are called as hook(name, start, duration) for every timed phase
+    (times in seconds, from time.perf_counter), and while tracing, phases
+    are also recorded to be exported as a Chrome trace (chrome://tracing).
+    Phases can be timed from any thread (the loader and the background save
+    have their own), the samples and the trace being guarded by a lock.
+    """
+
+    WINDOW = 240
+
+    def __init__(self):
+        self.samples = {}
+        self.hooks = []
+        self.trace = None
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def record(self, name, start, duration):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.WINDOW)
+            samples.append(duration)
+            if self.trace is not None:
+                self.trace.append({
+                    "name": name, "ph": "X", "pid": 0, "tid": threading.get_ident(),
+                    "ts": (start - self.origin) * 1e6, "dur": duration * 1e6,
+                })
+        for hook in self.hooks:
+            hook(name, start, duration)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def percentiles(self, name, ps=(50, 95, 99)):
+        """Percentiles of the recent durations of a phase, in seconds."""
+        with self.lock:
+            samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return [None for p in ps]
+        return [samples[min(len(samples) - 1, len(samples) * p // 100)] for p in ps]
+
+    def names(self):
+        with self.lock:
+            return sorted(self.samples)
+
+    def stats(self):
+        return {name: dict(zip(("p50", "p95", "p99"), self.percentiles(name))) for name in self.names()}
+
+    def start_trace(self):
+        with self.lock:
+            self.trace = []
+
+    def stop_trace(self, path):
+        """Stop tracing and write the trace to path."""
+        with self.lock:
+            trace, self.trace = self.trace, None
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": trace or [], "displayTimeUnit": "ms"}, f)
+
+    def on_render(self, dst, pos=(5, 30)):
+        """Draw the p50/p95 of every phase, in milliseconds."""
+        font = ASSETS.font(20)
+        x, y = pos
+        for name in self.names():
+            p50, p95 = self.percentiles(name, (50, 95))
+            txt = font.render("{:10} {:6.2f} {:6.2f} ms".format(name, p50 * 1000, p95 * 1000), True, (0,0,0), (255,255,255))
+            dst.blit(txt, (x, y))
+            y += txt.get_height()
+
+PROFILER = Profiler()
@@ -0,0 +1,157 @@
+import pygame
+from pygame.locals import *
+
+from profiler import PROFILER
+
+class DirtyRenderer:
+
+    """Draws the frames of an App, only updating the parts which changed.
+
+    The static layers are composed once into two window-sized surfaces: the
+    background and middleground under the characters, the foreground above
+    them. As long as the layers do not change, a frame only restores the
+    areas a character (or an entity of app.entities) left or entered, draws
+    the characters there, and pushes those areas with pygame.display.update.
+    When the camera moves by less than the window, the composed surfaces
+    and the window are scrolled, only the strips the move exposed are drawn
+    again, and the whole window is pushed (it is composed again, without
+    baking, when app.has_overlay()). Anything else (jumps of the camera, edited layers,
+    invalidate()) redraws the whole window. Every frame is then given to
+    app.exporter, if any.
+    """
+
+    BACKGROUND_COLOR = (200,200,200)
+
+    def __init__(self, app):
+        self.app = app
+        size = app.window.get_size()
+        self.below = pygame.Surface(size).convert()
+        self.above = pygame.Surface(size, SRCALPHA).convert_alpha()
+        self.drawn = {}
+        self.camera = None
+        self.revisions = None
+        self.full = True
+
+    def invalidate(self):
+        """Redraw the whole window on the next frame."""
+        self.full = True
+
+    def layers(self):
+        return (self.app.background, self.app.middleground, self.app.foreground)
+
+    def bake(self, area=None):
+        """Compose the layers, only in area (a window rect) if given."""
+        app = self.app
+        self.below.set_clip(area)
+        self.above.set_clip(area)
+        self.below.fill(self.BACKGROUND_COLOR, area)
+        app.background.on_render(self.below, app.camera)
+        app.middleground.on_render(self.below, app.camera)
+        self.above.fill((0,0,0,0), area)
+        app.foreground.on_render(self.above, app.camera)
+        self.below.set_clip(None)
+        self.above.set_clip(None)
+        self.camera = app.camera.rect.copy()
+        self.revisions = [l.revision for l in self.layers()]
+
+    def scroll(self, dx, dy):
+        """Scroll the composed layers by a move of the camera, only baking
+        the strips it exposed, returned as window rects."""
+        w, h = self.below.get_size()
+        self.below.scroll(-dx, -dy)
+        self.above.scroll(-dx, -dy)
+        strips = []
+        if dx:
+            strips.append(pygame.Rect(w - dx if dx > 0 else 0, 0, abs(dx), h))
+        if dy:
+            strips.append(pygame.Rect(0, h - dy if dy > 0 else 0, w, abs(dy)))
+        for r in strips:
+            self.bake(r)
+        return strips
+
+    def frame_rect(self, o, alpha):
+        """(image, screen rect) of character o for this frame."""
+        image, pos = o.frame(alpha)
+        return image, pygame.Rect(self.app.camera.apply(pos), image.get_size())
+
+    def sprites(self, alpha):
+        """(image, screen rect) of everything moving, keyed by the character
+        or by ("entity", index) for the characters of app.entities."""
+        frames = {o: self.frame_rect(o, alpha) for o in self.app.objects}
+        for i, image, r in self.app.entities.frames(self.app.camera):
+            frames[("entity", i)] = (image, r)
+        return frames
+
+    def render(self, alpha=1):
+        app = self.app
+        window = app.window
+        frames = self.sprites(alpha)
+        if self.camera is None:
+            self.full = True
+            dx = dy = 0
+        else:
+            dx, dy = app.camera.rect.x - self.camera.x, app.camera.rect.y - self.camera.y
+        w, h = window.get_size()
+        if self.full or abs(dx) >= w or abs(dy) >= h or app.camera.rect.size != self.camera.size or \
+                [l.revision for l in self.layers()] != self.revisions:
+            self.bake()
+            self.compose(frames)
+            return
+
+        dirty = []
+        if dx or dy:
+            dirty.extend(self.scroll(dx, dy))
+            if app.has_overlay():
+                self.compose(frames)
+                return
+            window.scroll(-dx, -dy)
+            # What was drawn moved with the window.
+            self.drawn = {key: (image, r.move(-dx, -dy)) for key, (image, r) in self.drawn.items()}
+        for key, (image, r) in frames.items():
+            old = self.drawn.get(key)
+            if old is None or old[0] is not image or old[1] != r:
+                dirty.append(r)
+                if old:
+                    dirty.append(old[1])
+        for key in self.drawn.keys() - frames.keys():
+            dirty.append(self.drawn[key][1])
+        self.drawn = frames
+
+        # Sprites overlapping a dirty area are drawn again entirely.
+        for image, r in frames.values():
+            if dirty and r.collidelist(dirty) != -1 and r not in dirty:
+                dirty.append(r)
+        for r in dirty:
+            window.blit(self.below, r, r)
+        for image, r in frames.values():
+            if dirty and r.collidelist(dirty) != -1:
+                window.blit(image, r)
+        for r in dirty:
+            window.blit(self.above, r, r)
+        if dx or dy:
+            # The whole window moved, not only the dirty areas.
+            with PROFILER.phase("display"):
+                pygame.display.flip()
+        elif dirty:
+            with PROFILER.phase("display"):
+                pygame.display.update(dirty)
+        self.export()
+
+    def compose(self, frames):
+        """Draw the whole window from the composed layers."""
+        window = self.app.window
+        window.blit(self.below, (0, 0))
+        for image, r in frames.values():
+            window.blit(image, r)
+        window.blit(self.above, (0, 0))
+        self.app.on_render_overlay()
+        with PROFILER.phase("display"):
+            pygame.display.flip()
+        self.drawn = frames
+        self.full = False
+        self.export()
+
+    def export(self):
+        if self.app.exporter is not None:
+            with PROFILER.phase("export"):
+                self.app.exporter.capture(self.app.window)
@@ -0,0 +1,241 @@
+#! /usr/bin/python3
+
+"""Simulates many independent instances of levels across a pool of processes.
+
+The middleground tiles of each level are decoded once, by the main process,
+into a shared memory block read by all the instances. Each instance has its
+own player, characters and collider, and is driven by an input script (see
+headless.py) or, without script, by a bot which runs right and jumps when
+blocked or at random.
+
+A level is completed when the player reaches the right end of its blocks. The
+player dies when it falls below the blocks or touches a character, and then
+starts over. The report gives, for each level, the completion rate, the
+completion times and the deaths of its instances.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import statistics
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pygame
+
+from app import SIMULATION_STEP, PLAYER_START
+from block import Block, BlockTypes, solidity_of
+from layer import Layer
+from bubbleLoader import BubbleLoader, read_level
+from character import Player, Collider
+from entities import EntityBatch
+from headless import InputScript
+import controls
+
+JUMP_RATE = 0.05
+
+def share_level(filepath):
+    """(shared memory block, picklable description) of the middleground
+    tiles of a level, chunk after chunk."""
+    data = read_level(filepath)
+    blocks_info = data.manifest['Blocks']
+    sheet = data.sheets[blocks_info['Sprite sheet']['Path']]
+    solidity = {}
+    for d in blocks_info['Sprite sheet']['Sprites description']:
+        image = sheet.subsurface((d['x'], d['y'], d['width'], d['height']))
+        solidity[d['Name']] = solidity_of(pygame.mask.from_surface(image))
+
+    layer = Layer()
+    if data.grids is not None:
+        layer.load_grid(data.grids["Middleground blocks"], data.palette)
+    else:
+        layer.load(blocks_info.get("Middleground blocks", []))
+    tiles = layer.tiles
+    chunks = sorted(tiles.chunks)
+    size = 2 * tiles.CHUNK_SIZE ** 2
+    memory = shared_memory.SharedMemory(create=True, size=max(size, size * len(chunks)))
+    for i, c in enumerate(chunks):
+        memory.buf[i * size:(i + 1) * size] = tiles.chunks[c].tobytes()
+
+    s = Block.BLOCK_SIZE
+    positions = [p for p, t in tiles.positions()]
+    bounds = (min(p[0] for p in positions), min(p[1] for p in positions),
+              max(p[0] for p in positions) + s, max(p[1] for p in positions) + s) if positions else (0, 0, 0, 0)
+    return memory, {
+        "level": filepath,
+        "memory": memory.name,
+        "chunks": chunks,
+        "palette": list(tiles.palette),
+        "solidity": solidity,
+        "bounds": bounds,
+    }
+
+class SharedLevel:
+
+    """A level attached by a process : its middleground, whose chunks are
+    views of the shared memory block, and the characters of the level."""
+
+    def __init__(self, shared):
+        self.memory = shared_memory.SharedMemory(shared["memory"])
+        self.ids = self.memory.buf.cast('H')
+        types = BlockTypes()
+        types.solidity.update(shared["solidity"])
+        self.middleground = Layer(types)
+        tiles = self.middleground.tiles
+        for name in shared["palette"]:
+            tiles.id_of(name)
+        n = tiles.CHUNK_SIZE ** 2
+        for i, c in enumerate(shared["chunks"]):
+            tiles.chunks[c] = self.ids[i * n:(i + 1) * n]
+        self.bounds = pygame.Rect(shared["bounds"][:2], (shared["bounds"][2] - shared["bounds"][0], shared["bounds"][3] - shared["bounds"][1]))
+
+        # The loader messages would mix with the report.
+        self.entities = EntityBatch()
+        with contextlib.redirect_stdout(sys.stderr):
+            data = read_level(shared["level"])
+            if 'Characters' in data.manifest:
+                loader = BubbleLoader(shared["level"], self)
+                loader.create_characters_types(data, data.manifest['Characters'])
+                loader.place_characters(data.manifest['Characters'])
+
+    def close(self):
+        self.middleground.tiles.chunks.clear()
+        self.ids.release()
+        self.memory.close()
+
+ATTACHED = {}
+
+def attach(shared):
+    """SharedLevel of shared in this process, attached once."""
+    level = ATTACHED.get(shared["memory"])
+    if level is None:
+        level = ATTACHED[shared["memory"]] = SharedLevel(shared)
+    return level
+
+class Simulation:
+
+    """An instance of a shared level, with the attributes of an App that the
+    Collider needs."""
+
+    def __init__(self, level, script=None, seed=0, jump_rate=JUMP_RATE):
+        self.level = level
+        self.middleground = level.middleground
+        self.entities = level.entities.copy()
+        self.script = script
+        self.random = random.Random(seed)
+        self.jump_rate = jump_rate
+        self.player = Player(PLAYER_START)
+        self.objects = {self.player}
+        self.collider = Collider(self)
+        self.deaths = 0
+
+    def respawn(self):
+        self.deaths += 1
+        self.player = Player(PLAYER_START)
+        self.objects = {self.player}
+
+    def inputs(self, tick):
+        """(held, pressed) bitsets of tick."""
+        if self.script is not None:
+            return self.script.snapshot(tick)
+        pressed = 0
+        if self.player.collide.right or self.random.random() < self.jump_rate:
+            pressed = controls.JUMP
+        return controls.RIGHT, pressed
+
+    def run(self, ticks):
+        """Run until the level is completed or for ticks, returns a report."""
+        bounds = self.level.bounds
+        completion = None
+        for tick in range(ticks):
+            controls.apply(self.player, *self.inputs(tick))
+            self.collider.collide()
+            self.player.on_update()
+            self.entities.update(self.collider.tiles)
+            rect = self.player.rect
+            # A level without blocks can not be completed nor fallen from.
+            if bounds.w and rect.right >= bounds.right:
+                completion = tick + 1
+                break
+            if (bounds.h and rect.top > bounds.bottom) or self.entities.touching(rect):
+                self.respawn()
+        return {
+            "completed": completion is not None,
+            "ticks": completion if completion is not None else ticks,
+            "completion_time": completion * SIMULATION_STEP / 1000 if completion is not None else None,
+            "deaths": self.deaths,
+        }
+
+def simulate(shared, script, seed, ticks, jump_rate=JUMP_RATE):
+    """Report of an instance of a shared level, run in a worker process."""
+    level = attach(shared)
+    entries = None
+    if script:
+        with open(script) as f:
+            entries = InputScript(json.load(f))
+    report = Simulation(level, entries, seed, jump_rate).run(ticks)
+    report.update(level=shared["level"], script=script, seed=seed)
+    return report
+
+def aggregate(reports):
+    """Summary of the reports of the instances of a level."""
+    times = [r["completion_time"] for r in reports if r["completed"]]
+    deaths = [r["deaths"] for r in reports]
+    return {
+        "instances": len(reports),
+        "completion_rate": len(times) / len(reports) if reports else None,
+        "completion_time": {
+            "mean": statistics.mean(times),
+            "median": statistics.median(times),
+            "min": min(times),
+            "max": max(times),
+        } if times else None,
+        "deaths": {"total": sum(deaths), "mean": statistics.mean(deaths)} if deaths else None,
+    }
+
+def run(levels, instances, ticks, scripts=(), jobs=None, jump_rate=JUMP_RATE):
+    """{level: summary and instance reports}, instances being run per level
+    and per script (or with the bot, without script)."""
+    memories = []
+    try:
+        shared = []
+        for level in levels:
+            memory, description = share_level(level)
+            memories.append(memory)
+            shared.append(description)
+        tasks = [(s, script, seed) for s in shared for script in (scripts or [None]) for seed in range(instances)]
+        with ProcessPoolExecutor(jobs) as pool:
+            chunksize = max(1, len(tasks) // (4 * (jobs or os.cpu_count() or 1)))
+            reports = list(pool.map(simulate, *zip(*tasks), [ticks] * len(tasks), [jump_rate] * len(tasks),
+                                    chunksize=chunksize))
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+    results = {}
+    for level in levels:
+        level_reports = [r for r in reports if r["level"] == level]
+        results[level] = {"summary": aggregate(level_reports), "instances": level_reports}
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many instances of levels in parallel and report their difficulty.")
+    parser.add_argument("levels", nargs="+")
+    parser.add_argument("-n", "--instances", type=int, default=100, help="instances per level and script")
+    parser.add_argument("-t", "--ticks", type=int, default=5000, help="maximum ticks of an instance")
+    parser.add_argument("-s", "--script", action="append", default=[], help="input script to replay, instead of the bot")
+    parser.add_argument("--jump-rate", type=float, default=JUMP_RATE, help="probability that the bot jumps at a tick")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes")
+    parser.add_argument("-o", "--output", help="write the report to this file")
+    args = parser.parse_args()
+
+    results = run(args.levels, args.instances, args.ticks, args.script, args.jobs, args.jump_rate)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -1,53 +1,86 @@
 import pygame
 from pygame.locals import *
 
+from block import solidity_of
+from assets import ASSETS
 
-class SpriteSheet:
 
-    def __init__(self, image_path):
-        self.image = pygame.image.load(image_path).convert_alpha()
+class SpriteSheet:
 
+    def __init__(self, image_path, namehint="", key=None):
+        """image_path can be a path, a decoded surface or a file object, in
+        which case namehint gives the name of the file for format detection.
+        key is the name of the sheet in the asset cache."""
+        self.key = key if key is not None else image_path
+        self.image = ASSETS.sheet(self.key, image_path, namehint)
 
     def image_at(self, rect):
-        image = self.image.subsurface(rect)
-        #image.convert_alpha()
-        return image.copy()
+        """Shared image of the sheet, it must not be drawn on."""
+        return ASSETS.image(self.key, rect, self.image)
 
     def images_at(self, rect, nb):
         return [self.image_at((i * rect[2], rect[1], rect[2], rect[3])) for i in range(nb)]
 
 
-class Animation:
+class FrameTable:
 
-    def __init__(self, images):
-        self.images = images
-        self.current = 0
+    """Frames of an animation, with their masks and solidities, shared by all
+    the characters playing it and never modified.
 
-    def next(self):
-        i = self.images[self.current]
-        self.current = (self.current + 1) % len(self.images)
-        return i
+    Each frame lasts delay simulation ticks. A looping animation starts over
+    after its last frame, else it stays on it.
+    """
 
-    def current_image(self):
-        return self.images[self.current]
+    __slots__ = ("images", "masks", "solidities", "size", "delay", "loop")
 
-    def stop(self):
-        self.current = 0
+    def __init__(self, images, delay=1, loop=True):
+        self.images = tuple(images)
+        self.masks = tuple(ASSETS.mask(i) for i in self.images)
+        self.solidities = tuple(solidity_of(m) for m in self.masks)
+        self.size = self.images[0].get_size()
+        self.delay = max(1, delay)
+        self.loop = loop
 
+    def index_at(self, ticks):
+        """Index of the frame shown ticks after the start of the animation."""
+        i = ticks // self.delay
+        n = len(self.images)
+        return i % n if self.loop else min(i, n - 1)
 
-class TimedAnimation(Animation):
 
-    def __init__(self, images, delta):
-        Animation.__init__(self, images)
-        self.timer = pygame.time.get_ticks()
-        self.delta = delta
+class Animations:
 
-    def next(self):
-        if (pygame.time.get_ticks() - self.timer) > self.delta:
-            self.timer = pygame.time.get_ticks()
-            return Animation.next(self)
-        else:
-            return self.images[self.current]
+    """The frame tables of the game, an animation id being an index in it.
 
-    def stop(self):
-        pass
+    A character only keeps the id of its animation and the tick at which it
+    started, its frame being computed from the current tick.
+    """
+
+    def __init__(self):
+        self.tables = []
+        self.ids = {}
+
+    def add(self, key, table):
+        """Id of the animation stored under key, which is table from now on."""
+        a = self.ids.get(key)
+        if a is None:
+            a = self.ids[key] = len(self.tables)
+            self.tables.append(table)
+        else:
+            self.tables[a] = table
+        return a
+
+    def get(self, key, make):
+        """Id of the animation stored under key, its table being made by
+        make() only the first time."""
+        a = self.ids.get(key)
+        if a is None:
+            a = self.add(key, make())
+        return a
+
+    def frames(self, anims, starts, tick):
+        """Frame indices at tick of the animations anims started at starts."""
+        tables = self.tables
+        return [tables[a].index_at(tick - s) for a, s in zip(anims, starts)]
+
+ANIMATIONS = Animations()
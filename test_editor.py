@@ -0,0 +1,64 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+import editor
+from editor import Editor
+from bubbleLoader import PRELOADER
+
+def edited_editor(tmp_path):
+    e = Editor()
+    e.journal.path = str(tmp_path / "level.journal")
+    e.journal.paint("Middleground", [(0, 0)], None if e.middleground.type_at((0, 0)) else e.menu.get_current())
+    return e
+
+def close(e):
+    e.journal.unsaved.clear()
+    PRELOADER.shutdown()
+    pygame.quit()
+
+def test_autosave_fires_in_mainloop(tmp_path, monkeypatch):
+    # Only the display is initialized since the lazy init of App.
+    monkeypatch.setattr(editor, "AUTOSAVE_DELAY", 20)
+    e = edited_editor(tmp_path)
+    frames = [0]
+    render = e.renderer.render
+    def stop_after_frames(*args):
+        render(*args)
+        frames[0] += 1
+        if frames[0] >= 5:
+            e.running = False
+    e.renderer.render = stop_after_frames
+    try:
+        e.on_mainloop()
+        assert os.path.exists(e.journal.path)
+        assert not e.journal.unsaved
+    finally:
+        close(e)
+
+def test_journal_kept_when_save_fails(tmp_path):
+    e = edited_editor(tmp_path)
+    def fail(blocks):
+        raise OSError("disk full")
+    e.loader.write_blocks = fail
+    try:
+        e.save()
+        e.check_save(wait=True)
+        assert os.path.exists(e.journal.path)
+        assert e.middleground.modified
+    finally:
+        close(e)
+
+def test_journal_discarded_once_saved(tmp_path):
+    e = edited_editor(tmp_path)
+    e.loader.write_blocks = lambda blocks: None
+    try:
+        e.save()
+        assert os.path.exists(e.journal.path)
+        e.check_save(wait=True)
+        assert not os.path.exists(e.journal.path)
+        assert not e.middleground.modified
+    finally:
+        close(e)
@@ -0,0 +1,137 @@
+from array import array
+
+from block import Block
+from levelformat import Grid
+
+class TileMap:
+
+    """Tile ids of a layer, stored by chunks of CHUNK_SIZE x CHUNK_SIZE
+    blocks, each chunk being an array of uint16.
+
+    Id 0 is an empty tile, id i is the block type palette[i-1]. Positions are
+    in pixels, like the keys of the layers.
+    """
+
+    CHUNK_SIZE = 16
+
+    def __init__(self):
+        self.chunks = {}
+        self.palette = []
+        self.ids = {}
+        self.count = 0
+
+    @staticmethod
+    def index_of(pos):
+        """(chunk, index in the chunk) of a position."""
+        s, c = Block.BLOCK_SIZE, TileMap.CHUNK_SIZE
+        bx, by = pos[0] // s, pos[1] // s
+        return (bx // c, by // c), (by % c) * c + bx % c
+
+    def id_of(self, name):
+        t = self.ids.get(name)
+        if t is None:
+            self.palette.append(name)
+            t = self.ids[name] = len(self.palette)
+        return t
+
+    def name_of(self, t):
+        return self.palette[t - 1] if t else None
+
+    def get(self, pos):
+        c, i = self.index_of(pos)
+        chunk = self.chunks.get(c)
+        return chunk[i] if chunk else 0
+
+    def set(self, pos, t):
+        """Set the tile id at pos, returns the previous one."""
+        c, i = self.index_of(pos)
+        chunk = self.chunks.get(c)
+        if chunk is None:
+            if not t:
+                return 0
+            chunk = self.chunks[c] = array('H', bytes(2 * self.CHUNK_SIZE ** 2))
+        old = chunk[i]
+        chunk[i] = t
+        self.count += bool(t) - bool(old)
+        return old
+
+    def set_grid(self, grid, palette):
+        """Copy the non empty tiles of a levelformat.Grid, whose ids refer
+        to palette."""
+        mapping = [0] + [self.id_of(name) for name in palette]
+        for pos, t in grid.positions():
+            self.set(pos, mapping[t])
+
+    def chunks_in(self, x, y, width, height, existing=True):
+        """Chunks overlapping the rect of width x height tiles from tile
+        (x, y). With existing, only the chunks of the map, found through
+        the chunk index when the rect covers more chunks than the map has."""
+        n = self.CHUNK_SIZE
+        cx0, cy0 = x // n, y // n
+        cx1, cy1 = (x + width - 1) // n, (y + height - 1) // n
+        if existing and (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.chunks):
+            return [c for c in self.chunks if cx0 <= c[0] <= cx1 and cy0 <= c[1] <= cy1]
+        cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        return [c for c in cells if c in self.chunks] if existing else cells
+
+    def spans(self, c, x, y, width, height):
+        """(index in chunk c, index in the rect, length) of the rows of the
+        chunk inside the rect of tiles."""
+        n = self.CHUNK_SIZE
+        ox, oy = c[0] * n, c[1] * n
+        x0, x1 = max(x, ox), min(x + width, ox + n)
+        for row in range(max(y, oy), min(y + height, oy + n)):
+            yield (row - oy) * n + x0 - ox, (row - y) * width + x0 - x, x1 - x0
+
+    def read_grid(self, x, y, width, height):
+        """Grid of the ids of the rect of tiles, copied row after row from
+        the chunks."""
+        grid = Grid(x, y, width, height)
+        ids = grid.ids
+        for c in self.chunks_in(x, y, width, height):
+            chunk = self.chunks[c]
+            for i, j, l in self.spans(c, x, y, width, height):
+                ids[j:j + l] = chunk[i:i + l]
+        return grid
+
+    def write_grid(self, grid):
+        """Replace the tiles of the rect of grid by its ids, empty ones
+        included. Returns the chunks which changed."""
+        x, y, w, h, ids = grid.x, grid.y, grid.width, grid.height, grid.ids
+        changed = []
+        for c in self.chunks_in(x, y, w, h, existing=False):
+            chunk = self.chunks.get(c)
+            touched = False
+            for i, j, l in self.spans(c, x, y, w, h):
+                new = ids[j:j + l]
+                if chunk is None:
+                    if new.count(0) == l:
+                        continue
+                    chunk = self.chunks[c] = array('H', bytes(2 * self.CHUNK_SIZE ** 2))
+                old = chunk[i:i + l]
+                if old != new:
+                    self.count += old.count(0) - new.count(0)
+                    chunk[i:i + l] = new
+                    touched = True
+            if touched:
+                changed.append(c)
+        return changed
+
+    def chunk_positions(self, c):
+        """(position, id) of the non empty tiles of chunk c."""
+        chunk = self.chunks.get(c)
+        if not chunk:
+            return
+        s, n = Block.BLOCK_SIZE, self.CHUNK_SIZE
+        x, y = c[0] * n, c[1] * n
+        for i, t in enumerate(chunk):
+            if t:
+                yield ((x + i % n) * s, (y + i // n) * s), t
+
+    def positions(self):
+        for c in list(self.chunks):
+            yield from self.chunk_positions(c)
+
+    def clear(self):
+        self.chunks.clear()
+        self.count = 0
@@ -0,0 +1,113 @@
+from array import array
+
+from block import Block, EMPTY
+from tilemap import TileMap
+
+class TileHit:
+
+    """Result of TileQuery.sweep, meant to be reused from a query to the next.
+
+    dx, dy is the part of the movement which can be done, x_tile and y_tile
+    the position of the solid tile stopping it along each axis, or None.
+    """
+
+    __slots__ = ("dx", "dy", "x_tile", "y_tile")
+
+    def __init__(self):
+        self.dx = 0
+        self.dy = 0
+        self.x_tile = None
+        self.y_tile = None
+
+class TileQuery:
+
+    """Queries of the solid tiles of a layer, answered from its tile ids.
+
+    The solidity of every tile id is kept in a table, updated when the layer
+    changes, so that a query only reads the chunks of the tile map : no
+    Block is created.
+    Rects can be anything unpacking to (x, y, width, height), of any size,
+    and movements of any length are swept tile after tile, so that nothing
+    goes through a solid tile.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.solidity = array('B', [EMPTY])
+        self.revision = None
+        self.hit = TileHit()
+        self.found = []
+
+    def update(self):
+        """Update the solidity table if the layer changed."""
+        if self.revision != self.layer.revision:
+            palette, solidity = self.layer.tiles.palette, self.layer.types.solidity
+            self.solidity = array('B', [EMPTY] + [solidity.get(n, EMPTY) for n in palette])
+            self.revision = self.layer.revision
+
+    def overlapping(self, rect):
+        """Positions of the solid tiles overlapping rect. The list is reused
+        by the next call."""
+        self.update()
+        s, n = Block.BLOCK_SIZE, TileMap.CHUNK_SIZE
+        solidity, chunks = self.solidity, self.layer.tiles.chunks
+        x, y, w, h = rect
+        found = self.found
+        found.clear()
+        for by in range(y // s, (y + h - 1) // s + 1):
+            for bx in range(x // s, (x + w - 1) // s + 1):
+                chunk = chunks.get((bx // n, by // n))
+                if chunk and solidity[chunk[(by % n) * n + bx % n]]:
+                    found.append((bx * s, by * s))
+        return found
+
+    def sweep_axis(self, x, y, w, h, d, horizontal):
+        """(part of a move of the rect by d along an axis which can be done,
+        position of the solid tile stopping it or None). The tiles the rect
+        already overlaps do not stop it."""
+        if d == 0:
+            return 0, None
+        s, n = Block.BLOCK_SIZE, TileMap.CHUNK_SIZE
+        solidity, chunks = self.solidity, self.layer.tiles.chunks
+        if horizontal:
+            start, size, lo, hi = x, w, y, y + h
+        else:
+            start, size, lo, hi = y, h, x, x + w
+        across = range(lo // s, (hi - 1) // s + 1)
+        edge = start + size
+        if d > 0:
+            cells = range((edge - 1) // s + 1, (edge - 1 + d) // s + 1)
+        else:
+            cells = range(start // s - 1, (start + d) // s - 1, -1)
+        for c in cells:
+            for a in across:
+                bx, by = (c, a) if horizontal else (a, c)
+                chunk = chunks.get((bx // n, by // n))
+                if chunk and solidity[chunk[(by % n) * n + bx % n]]:
+                    return (c * s - edge if d > 0 else (c + 1) * s - start), (bx * s, by * s)
+        return d, None
+
+    def sweep(self, rect, dx, dy, hit=None):
+        """Move rect by dx and then by dy, stopping at the first solid tiles
+        on the way. Fills and returns hit, by default the TileHit of the
+        query, overwritten by the next call."""
+        self.update()
+        if hit is None:
+            hit = self.hit
+        x, y, w, h = rect
+        hit.dx, hit.x_tile = self.sweep_axis(x, y, w, h, dx, True)
+        hit.dy, hit.y_tile = self.sweep_axis(x + hit.dx, y, w, h, dy, False)
+        return hit
+
+    def touching(self, rect, collide):
+        """Fill a CollideDirection with the solid tiles touching each side of
+        rect, and the first one it overlaps as center."""
+        self.update()
+        x, y, w, h = rect
+        collide.left = self.sweep_axis(x, y, w, h, -1, True)[1]
+        collide.right = self.sweep_axis(x, y, w, h, 1, True)[1]
+        collide.top = self.sweep_axis(x, y, w, h, -1, False)[1]
+        collide.bottom = self.sweep_axis(x, y, w, h, 1, False)[1]
+        found = self.overlapping(rect)
+        collide.center = found[0] if found else None
+        return collide
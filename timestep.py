@@ -0,0 +1,34 @@
+class FixedTimestep:
+
+    """Runs a simulation at a fixed rate, whatever the frame rate.
+
+    The elapsed time of each frame is added to an accumulator, which is
+    consumed by steps of `step` milliseconds. What is left is the fraction
+    of a step (alpha) to interpolate the rendering with.
+    """
+
+    def __init__(self, step, max_steps=5):
+        """args :
+            - step : duration of a simulation step, in milliseconds
+            - max_steps : maximum number of steps run in a single frame, the
+              simulation slows down instead of spiralling when it is reached
+        """
+        self.step = step
+        self.max_steps = max_steps
+        self.accumulator = 0
+        self.tick = 0
+
+    def advance(self, elapsed):
+        """Number of steps to run for elapsed milliseconds."""
+        self.accumulator += elapsed
+        n = int(self.accumulator // self.step)
+        if n > self.max_steps:
+            n = self.max_steps
+            self.accumulator = self.step * n
+        self.accumulator -= self.step * n
+        self.tick += n
+        return n
+
+    @property
+    def alpha(self):
+        return self.accumulator / self.step